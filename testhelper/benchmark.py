@@ -0,0 +1,330 @@
+"""
+Benchmarks for views called directly with requests from a RequestFactory.
+
+bench = ViewBenchmark('multi_template', iterations=1000)
+result = bench.run()
+print result['latency_ms']['p99'], result['requests_per_second']
+write_results([result], 'views.json')
+
+A view is given as a callable, a URL name or a path, the last two resolved
+through the ROOT_URLCONF. The recipe describes the request to send: a dict
+with 'method' ('get' or 'post'), 'path', 'data' and any extra environ keys,
+or a callable taking the factory and returning a request.
+
+Each run reports latency percentiles in milliseconds, throughput, queries
+per request and the peak memory allocated while handling requests, or
+without the tracemalloc module, as on Python 2, an estimate of the memory
+the responses keep alive. Views that query the database need a test
+database, so run those from inside a test.
+
+measure_import times importing a module in a fresh interpreter, to keep
+the startup of short test runs in check.
+
+FactoryBenchmark times a recipe creating objects through a DjangoTestCase,
+reporting objects per second, queries and memory per object for each
+number of objects. compare_results checks results against a baseline
+written by write_results.
+
+measure_response_memory shows what test client responses keep alive under
+each capture policy of testhelper.capture.
+"""
+from __future__ import with_statement
+import datetime, gc, math, os, platform, subprocess, sys, time
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import django
+from django.core.urlresolvers import reverse, resolve, NoReverseMatch
+
+from testhelper.queries import CaptureQueries
+from testhelper.requestfactory import SlimRequestFactory
+
+if sys.platform == 'win32':
+    timer = time.clock
+else:
+    timer = time.time
+
+def percentile(sorted_values, percent):
+    "Nearest-rank percentile of an already sorted list."
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[max(0, min(rank, len(sorted_values)) - 1)]
+
+def summarize_latencies(latencies):
+    "Latency statistics in milliseconds for a list of durations in seconds."
+    ms = sorted([l * 1000 for l in latencies])
+    return {
+        'min': ms[0],
+        'mean': sum(ms) / len(ms),
+        'p50': percentile(ms, 50),
+        'p90': percentile(ms, 90),
+        'p99': percentile(ms, 99),
+        'max': ms[-1],
+    }
+
+def measure_peak_memory(func, iterations):
+    """
+    Peak bytes allocated while calling func iterations times. Without
+    tracemalloc it falls back to measure_retained_memory.
+    """
+    if not iterations:
+        return None
+    if tracemalloc is None:
+        return measure_retained_memory(func, iterations)
+    tracemalloc.start()
+    try:
+        for i in xrange(iterations):
+            func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+def measure_retained_memory(func, iterations):
+    """
+    Bytes kept alive by what func returns, over iterations calls: the size
+    of every object the garbage collector tracks that the calls created and
+    that is still around while their return values are, along with the
+    strings and numbers those objects hold. An estimate, counting objects
+    the way measure_response_memory does.
+    """
+    gc.collect()
+    before = set([id(o) for o in gc.get_objects()])
+    returned = [func() for i in xrange(iterations)]
+    gc.collect()
+    ignored = set([id(before), id(returned)])
+    seen = set()
+    size = 0
+    for o in gc.get_objects():
+        if id(o) in before or id(o) in ignored:
+            continue
+        for obj in [o] + [r for r in gc.get_referents(o) if not gc.is_tracked(r)]:
+            if id(obj) not in seen:
+                seen.add(id(obj))
+                size += sys.getsizeof(obj)
+    del returned
+    return size
+
+_import_script = """
+import sys, time
+before = set(sys.modules)
+started = time.time()
+__import__(%r)
+print time.time() - started
+print ' '.join(sorted(set(sys.modules) - before))
+"""
+
+def measure_import(module, repeat=5, python=None):
+    """
+    Imports module in repeat fresh interpreters, with this process's path
+    and environment, and returns the fastest import time in seconds along
+    with the modules the import loaded.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([p for p in sys.path if p]))
+    times = []
+    for i in xrange(repeat):
+        process = subprocess.Popen([python or sys.executable, '-c', _import_script % module],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        output, errors = process.communicate()
+        if process.returncode:
+            raise ImportError("Importing %s failed:\n%s" % (module, errors))
+        seconds, modules = output.split('\n', 1)
+        times.append(float(seconds))
+    return {
+        'name': 'import %s' % module,
+        'seconds': min(times),
+        'modules': modules.split(),
+    }
+
+class ViewBenchmark(object):
+    def __init__(self, view, recipe=None, name=None, warmup=50, iterations=1000,
+            memory_iterations=100, factory=None):
+        self.view, self.args, self.kwargs, path = self.resolve_view(view)
+        self.recipe = recipe or {}
+        if isinstance(self.recipe, dict) and 'path' not in self.recipe:
+            self.recipe = dict(self.recipe, path=path)
+        self.name = name or (isinstance(view, basestring) and view or view.__name__)
+        self.warmup = warmup
+        self.iterations = iterations
+        self.memory_iterations = memory_iterations
+        self.factory = factory or SlimRequestFactory()
+
+    def resolve_view(self, view):
+        "Returns (callable, args, kwargs, path) for a callable, URL name or path."
+        if callable(view):
+            return view, (), {}, '/'
+        try:
+            path = reverse(view)
+        except NoReverseMatch:
+            path = view
+        func, args, kwargs = resolve(path)
+        return func, args, kwargs, path
+
+    def build_request(self):
+        if callable(self.recipe):
+            return self.recipe(self.factory)
+        recipe = self.recipe.copy()
+        method = recipe.pop('method', 'get')
+        path = recipe.pop('path')
+        data = recipe.pop('data', {})
+        return getattr(self.factory, '%s_request' % method)(path, data, **recipe)
+
+    def call(self):
+        return self.view(self.build_request(), *self.args, **self.kwargs)
+
+    def run(self):
+        "Runs the benchmark and returns its results as a dict."
+        for i in xrange(self.warmup):
+            self.call()
+
+        latencies = []
+        statuses = {}
+        with CaptureQueries() as queries:
+            started = timer()
+            for i in xrange(self.iterations):
+                call_started = timer()
+                response = self.call()
+                latencies.append(timer() - call_started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            elapsed = timer() - started
+
+        return {
+            'name': self.name,
+            'iterations': self.iterations,
+            'latency_ms': summarize_latencies(latencies),
+            'requests_per_second': self.iterations / elapsed,
+            'queries_per_request': float(len(queries)) / self.iterations,
+            'peak_memory_bytes': measure_peak_memory(self.call, self.memory_iterations),
+            'status_codes': dict([(str(code), count) for code, count in statuses.items()]),
+        }
+
+class FactoryBenchmark(object):
+    """
+    Times recipe(testcase, n), which creates n objects with the testcase's
+    factory methods, for every n in counts, keeping the fastest of repeat
+    runs. Run it from inside a test, whose transaction removes the objects.
+    The recipe returns the objects, so that their memory can be measured
+    without tracemalloc.
+    """
+    def __init__(self, name, recipe, counts=(1, 10, 100), repeat=3):
+        self.name = name
+        self.recipe = recipe
+        self.counts = counts
+        self.repeat = repeat
+
+    def run(self, testcase):
+        "Returns a list with the results for each count."
+        results = []
+        for n in self.counts:
+            best = None
+            for i in xrange(self.repeat):
+                with CaptureQueries() as queries:
+                    started = timer()
+                    self.recipe(testcase, n)
+                    elapsed = timer() - started
+                if best is None or elapsed < best:
+                    best = elapsed
+            peak = measure_peak_memory(lambda: self.recipe(testcase, n), 1)
+            if peak is not None:
+                peak = peak / n
+            results.append({
+                'name': '%s x%s' % (self.name, n),
+                'objects': n,
+                'objects_per_second': n / max(best, 1e-9),
+                'queries_per_object': float(len(queries)) / n,
+                'memory_per_object_bytes': peak,
+            })
+        return results
+
+def measure_response_memory(client, path, requests=20):
+    """
+    What each response to a GET of path keeps alive while it is around: the
+    number of objects tracked by the garbage collector and, with
+    tracemalloc, the bytes allocated. Needs the test environment set up,
+    for the client to see the rendered templates.
+    """
+    client.get(path)
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    before = len(gc.get_objects())
+    responses = [client.get(path) for i in xrange(requests)]
+    gc.collect()
+    objects = len(gc.get_objects()) - before
+    size = None
+    if tracemalloc is not None:
+        size = tracemalloc.get_traced_memory()[0] / float(requests)
+        tracemalloc.stop()
+    del responses
+    return {
+        'path': path,
+        'objects_per_response': float(objects) / requests,
+        'bytes_per_response': size,
+    }
+
+# For each metric compared against a baseline, whether higher is better.
+COMPARED_METRICS = {
+    'objects_per_second': True,
+    'requests_per_second': True,
+    'queries_per_object': False,
+    'queries_per_request': False,
+    'memory_per_object_bytes': False,
+    'peak_memory_bytes': False,
+}
+
+def compare_results(results, baseline, threshold=0.2):
+    """
+    Compares a list of results with a baseline, a dict of results keyed by
+    name as returned by read_results. Returns a message for every metric
+    more than threshold (a fraction) worse than in the baseline. Query
+    counts don't vary between runs, so any increase is reported.
+    """
+    regressions = []
+    for result in results:
+        expected = baseline.get(result['name'])
+        if expected is None:
+            continue
+        for metric, higher_is_better in sorted(COMPARED_METRICS.items()):
+            value, base = result.get(metric), expected.get(metric)
+            if value is None or base is None:
+                continue
+            if higher_is_better:
+                worse = value < base * (1 - threshold)
+            elif metric.startswith('queries'):
+                worse = value > base
+            else:
+                worse = value > base * (1 + threshold)
+            if worse:
+                regressions.append("%s: %s went from %.4g to %.4g" % (result['name'], metric, base, value))
+    return regressions
+
+def environment():
+    "Describes where results were measured, to tell runs apart when diffing them."
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        'timestamp': datetime.datetime.now().isoformat(),
+    }
+
+def write_results(results, path):
+    "Writes a list of benchmark results to path as JSON."
+    f = open(path, 'w')
+    try:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2, sort_keys=True)
+    finally:
+        f.close()
+
+def read_results(path):
+    "Reads results written by write_results, as a dict keyed by benchmark name."
+    data = json.load(open(path))
+    return dict([(result['name'], result) for result in data['results']])
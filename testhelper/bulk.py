@@ -0,0 +1,130 @@
+"""
+Multi-row INSERT helpers used by DjangoTestCase.create_objects.
+
+Django has no bulk insert API, so these build the statements by hand from
+the model's field definitions, mirroring what Model.save_base does for a
+single row. Signals are not sent for rows inserted this way.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import AutoField
+
+# SQLite refuses statements with more than 999 parameters or more than 500
+# rows in a compound SELECT; stay under both for every backend.
+MAX_BATCH_PARAMS = 999
+MAX_BATCH_ROWS = 500
+
+# Which row of a multi-row INSERT each backend's last_insert_id returns the
+# id of. Backends missing here insert one row per statement when the
+# primary keys have to be filled in.
+INSERT_ID_ROW = {
+    'sqlite3': 'last',
+    'postgresql': 'last',
+    'postgresql_psycopg2': 'last',
+    'mysql': 'first',
+}
+
+def _supports_multirow_values():
+    "SQLite only understands INSERT ... VALUES (...), (...) since 3.7.11."
+    if settings.DATABASE_ENGINE != 'sqlite3':
+        return True
+    from django.db.backends.sqlite3.base import Database
+    return Database.sqlite_version_info >= (3, 7, 11)
+
+def get_batch_size(column_count, batch_size=None):
+    "Largest number of rows per statement that stays inside the backend limits."
+    limit = max(1, min(MAX_BATCH_ROWS, MAX_BATCH_PARAMS // max(1, column_count)))
+    if batch_size:
+        return min(batch_size, limit)
+    return limit
+
+def insert_objects(klass, objects, batch_size=None):
+    """
+    Saves unsaved instances of klass with as few INSERT statements as the
+    backend allows, then fills in their primary keys.
+
+    Primary keys are derived from the id last_insert_id reports, that of the
+    last inserted row on SQLite and PostgreSQL and of the first on MySQL,
+    which assumes the auto-incrementing key hands out consecutive values
+    inside a statement, as they do for a single writer. Other backends get
+    one INSERT per object. Models using multi-table inheritance fall back
+    to save().
+    """
+    if not objects:
+        return objects
+
+    opts = klass._meta
+    if opts.parents:
+        for o in objects:
+            o.save()
+        return objects
+
+    with_pk = [o for o in objects if o.pk is not None]
+    if with_pk and len(with_pk) != len(objects):
+        raise ValueError("Either all or none of the objects passed to insert_objects may have a primary key.")
+    update_pk = bool(opts.has_auto_field and not with_pk)
+
+    if update_pk:
+        fields = [f for f in opts.local_fields if not isinstance(f, AutoField)]
+    else:
+        fields = opts.local_fields
+
+    if fields:
+        columns = [f.column for f in fields]
+        rows = [[f.get_db_prep_save(f.pre_save(o, True)) for f in fields] for o in objects]
+        _insert(opts.db_table, columns, rows, batch_size, objects, update_pk and opts.pk)
+    else:
+        # Nothing but an auto field, let the database pick every value.
+        _insert(opts.db_table, [opts.pk.column], [[]] * len(objects), batch_size,
+            objects, opts.pk, raw_value=connection.ops.pk_default_value())
+
+    transaction.commit_unless_managed()
+    return objects
+
+def insert_m2m(field, pairs, batch_size=None):
+    """
+    Adds rows to the join table of ManyToManyField field. pairs is a list
+    of (source_pk, target_pk) tuples.
+    """
+    if field.rel.through is not None:
+        raise ValueError("Cannot bulk insert into %s, it uses an intermediary model." % field.name)
+    if not pairs:
+        return
+    columns = [field.m2m_column_name(), field.m2m_reverse_name()]
+    _insert(field.m2m_db_table(), columns, [list(p) for p in pairs], batch_size)
+    transaction.commit_unless_managed()
+
+def _insert(table, columns, rows, batch_size=None, objects=None, pk_field=None, raw_value=None):
+    """
+    Runs one INSERT per batch of rows. When pk_field is given, the primary
+    keys of the matching objects are set from the inserted ids, see
+    INSERT_ID_ROW. When raw_value is given it is written into the SQL for
+    every column instead of a parameter.
+    """
+    qn = connection.ops.quote_name
+    batch_size = get_batch_size(len(columns), batch_size)
+    id_row = INSERT_ID_ROW.get(settings.DATABASE_ENGINE)
+    if pk_field and id_row is None:
+        batch_size = 1
+    placeholders = ", ".join([raw_value or "%s"] * len(columns))
+    column_sql = ", ".join([qn(c) for c in columns])
+    multirow = _supports_multirow_values()
+
+    cursor = connection.cursor()
+    for start in xrange(0, len(rows), batch_size):
+        chunk = rows[start:start + batch_size]
+        params = []
+        for row in chunk:
+            params.extend(row)
+        if multirow:
+            values_sql = "VALUES " + ", ".join(["(%s)" % placeholders] * len(chunk))
+        else:
+            values_sql = " UNION ALL ".join(["SELECT %s" % placeholders] * len(chunk))
+        cursor.execute("INSERT INTO %s (%s) %s" % (qn(table), column_sql, values_sql), params)
+
+        if pk_field:
+            first_id = connection.ops.last_insert_id(cursor, table, pk_field.column)
+            if id_row == 'last':
+                first_id -= len(chunk) - 1
+            for offset, o in enumerate(objects[start:start + batch_size]):
+                setattr(o, pk_field.attname, first_id + offset)
@@ -0,0 +1,80 @@
+"""
+How much of what a view rendered the test client keeps on its responses.
+
+Django's test client puts every rendered template and the context it was
+rendered with on response.template and response.context. That keeps each
+template's node tree and every object in the contexts alive, querysets and
+their rows included, for as long as the response is. ResponseCaptureClient
+can keep less:
+
+    'full'       templates and contexts, as the test client does
+    'templates'  only the template names, enough for get_template and the
+                 template assertions
+    'none'       nothing, response.template and response.context are None
+"""
+from django.test import signals
+from django.test.client import Client
+from django.utils.functional import curry
+
+CAPTURE_POLICIES = ('none', 'templates', 'full')
+
+class RenderedTemplate(object):
+    "Stands in for a rendered Template on a response, remembering only its name."
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return "<RenderedTemplate %r>" % self.name
+
+def store_template_names(store, signal, sender, template, context, **kwargs):
+    store.append(RenderedTemplate(getattr(template, 'name', None)))
+
+def ignore_rendering(signal, sender, **kwargs):
+    pass
+
+class ResponseCaptureClient(Client):
+    "A test Client keeping what its capture policy says on every response."
+    def __init__(self, capture='full', **defaults):
+        Client.__init__(self, **defaults)
+        self.capture = capture
+
+    def request(self, **request):
+        if self.capture not in CAPTURE_POLICIES:
+            raise ValueError("Response capture is one of %s, not %r." % (', '.join(CAPTURE_POLICIES), self.capture))
+        if self.capture == 'full':
+            return Client.request(self, **request)
+
+        templates = []
+        if self.capture == 'templates':
+            receiver = curry(store_template_names, templates)
+        else:
+            receiver = ignore_rendering
+        # Client.request doesn't connect its own receiver while one with
+        # the same dispatch_uid is connected, and disconnects ours when done.
+        signals.template_rendered.connect(receiver, dispatch_uid="template-render")
+        try:
+            response = Client.request(self, **request)
+        finally:
+            signals.template_rendered.disconnect(dispatch_uid="template-render")
+        if len(templates) == 1:
+            response.template = templates[0]
+        else:
+            response.template = templates or None
+        return response
+
+class ResponseCapture(object):
+    "Changes the capture policy of a ResponseCaptureClient inside a with block."
+    def __init__(self, client, capture):
+        self.client = client
+        self.capture = capture
+
+    def __enter__(self):
+        self.previous = self.client.capture
+        self.client.capture = self.capture
+        return self.client
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.client.capture = self.previous
+        return False
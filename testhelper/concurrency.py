@@ -0,0 +1,212 @@
+"""
+Sends requests to a view from several threads at once, to check how it
+behaves under concurrency: lock contention, cache stampedes, running out
+of connections.
+
+driver = ConcurrentDriver('multi_template', concurrency=8, requests=200)
+result = driver.run()
+print result['latency_ms']['p99'], result['error_rate'], result['queries_per_request']
+
+Views, recipes and factories are given as for testhelper.benchmark's
+ViewBenchmark. With through_handler on, requests go through the whole
+handler stack, URL resolution and middleware included, instead of straight
+to the view.
+
+Django keeps one database connection per thread, so by default the
+threads' queries are run on the connection of the thread calling run(),
+one at a time. They see the test's uncommitted rows and work against the
+sqlite in-memory test database. Commits and rollbacks from the threads are
+ignored, so whatever the views write is rolled back with the test. With
+share_connection off every thread opens a connection of its own, which
+only sees committed rows, needs a database other than sqlite's in-memory
+one, and leaves behind whatever the views commit.
+"""
+import Queue, sys, threading, traceback
+
+from django.core.handlers.base import BaseHandler
+from django.db import connection
+
+from testhelper.benchmark import ViewBenchmark, summarize_latencies, timer
+from testhelper.queries import _install_debug_cursor, _uninstall_debug_cursor
+
+# Tracebacks kept in the results of a run.
+MAX_ERROR_SAMPLES = 5
+
+class ConnectionOwner(object):
+    """
+    Runs database calls made by other threads on the thread that created
+    the connection, which is the only one allowed to use a sqlite one.
+    """
+    def __init__(self, db=None):
+        self.db = db or connection
+        if self.db.connection is None:
+            self.db.cursor()
+        self.connection = self.db.connection
+        self.calls = Queue.Queue()
+
+    def call(self, func, *args, **kwargs):
+        "Calls func on the owning thread and returns its result."
+        reply = Queue.Queue(1)
+        self.calls.put((func, args, kwargs, reply))
+        ok, value = reply.get()
+        if not ok:
+            raise value[0], value[1], value[2]
+        return value
+
+    def serve(self, threads):
+        "Runs calls until every thread in threads has finished."
+        while True:
+            try:
+                func, args, kwargs, reply = self.calls.get(timeout=0.01)
+            except Queue.Empty:
+                if not [t for t in threads if t.isAlive()]:
+                    return
+                continue
+            try:
+                reply.put((True, func(*args, **kwargs)))
+            except:
+                reply.put((False, sys.exc_info()))
+
+class RemoteObject(object):
+    "Stands in for a DB-API connection or cursor, calling its methods through a ConnectionOwner."
+    def __init__(self, owner, target):
+        self.__dict__['_owner'] = owner
+        self.__dict__['_target'] = target
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not callable(value):
+            return value
+        def method(*args, **kwargs):
+            result = self._owner.call(value, *args, **kwargs)
+            if result is self._target:
+                return self
+            if hasattr(result, 'fetchone'):
+                return RemoteObject(self._owner, result)
+            return result
+        return method
+
+    def __setattr__(self, name, value):
+        self._owner.call(setattr, self._target, name, value)
+
+    def __iter__(self):
+        return iter(self._owner.call(list, self._target))
+
+class RemoteConnection(RemoteObject):
+    """
+    The owner's connection, as seen by a worker thread, which must not close
+    it. Worker threads aren't under transaction management, so Django
+    commits after every save; the transaction belongs to the owner, and
+    the test it's running, so commits and rollbacks do nothing.
+    """
+    def close(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+class DriverHandler(BaseHandler):
+    """
+    The handler stack of the test client, without the request_started and
+    request_finished signals, which would reset and close the connection
+    in the middle of a run.
+    """
+    def __call__(self, request):
+        response = self.get_response(request)
+        for middleware_method in self._response_middleware:
+            response = middleware_method(request, response)
+        return self.apply_response_fixes(request, response)
+
+class ConcurrentDriver(ViewBenchmark):
+    def __init__(self, view, recipe=None, name=None, concurrency=4, requests=100,
+            through_handler=False, share_connection=True, factory=None):
+        ViewBenchmark.__init__(self, view, recipe, name, warmup=0, iterations=requests,
+            memory_iterations=0, factory=factory)
+        self.concurrency = concurrency
+        self.requests = requests
+        self.through_handler = through_handler
+        self.share_connection = share_connection
+        self.handler = None
+
+    def dispatch(self, request):
+        if self.handler is not None:
+            return self.handler(request)
+        return self.view(request, *self.args, **self.kwargs)
+
+    def run(self):
+        "Sends the requests and returns the results as a dict."
+        if self.through_handler and self.handler is None:
+            self.handler = DriverHandler()
+            self.handler.load_middleware()
+        owner = self.share_connection and ConnectionOwner() or None
+
+        jobs = Queue.Queue()
+        for index in xrange(self.requests):
+            jobs.put(index)
+        samples = [None] * self.requests
+        threads = [threading.Thread(target=self.work, args=(jobs, samples, owner))
+            for i in xrange(min(self.concurrency, self.requests))]
+
+        started = timer()
+        for thread in threads:
+            thread.start()
+        if owner is not None:
+            owner.serve(threads)
+        for thread in threads:
+            thread.join()
+        elapsed = timer() - started
+        return self.summarize(samples, elapsed)
+
+    def work(self, jobs, samples, owner):
+        "Handles requests from jobs until there are none left, in a worker thread."
+        if owner is not None:
+            connection.connection = RemoteConnection(owner, owner.connection)
+        _install_debug_cursor(connection)
+        try:
+            while True:
+                try:
+                    index = jobs.get_nowait()
+                except Queue.Empty:
+                    return
+                before = len(connection.queries)
+                call_started = timer()
+                try:
+                    request = self.build_request()
+                    call_started = timer()
+                    status, error = self.dispatch(request).status_code, None
+                except Exception:
+                    status, error = None, traceback.format_exc()
+                samples[index] = (timer() - call_started, status, len(connection.queries) - before, error)
+        finally:
+            _uninstall_debug_cursor(connection)
+            if owner is not None:
+                connection.connection = None
+            else:
+                connection.close()
+
+    def summarize(self, samples, elapsed):
+        statuses = {}
+        errors = []
+        for seconds, status, queries, error in samples:
+            if error is not None:
+                errors.append(error)
+            else:
+                statuses[status] = statuses.get(status, 0) + 1
+        failed = len(errors) + sum([count for status, count in statuses.items() if status >= 500])
+        query_counts = [queries for seconds, status, queries, error in samples]
+        return {
+            'name': self.name,
+            'requests': self.requests,
+            'concurrency': self.concurrency,
+            'latency_ms': summarize_latencies([seconds for seconds, status, queries, error in samples]),
+            'requests_per_second': self.requests / elapsed,
+            'queries_per_request': float(sum(query_counts)) / self.requests,
+            'max_queries': max(query_counts),
+            'status_codes': dict([(str(code), count) for code, count in statuses.items()]),
+            'errors': len(errors),
+            'error_rate': float(failed) / self.requests,
+            'error_samples': errors[:MAX_ERROR_SAMPLES],
+        }
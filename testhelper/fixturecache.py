@@ -0,0 +1,260 @@
+"""
+Rows created by fixture recipes, kept on disk between test runs.
+
+A recipe is a function taking the testcase, creating objects with
+create_object and friends and returning a dict of the ones the tests need.
+DjangoTestCase.load_cached_objects runs it once, records every row it
+added, and writes them to a gzipped JSON file in the cache directory.
+Later runs insert those rows with a few multi-row INSERTs instead of
+running the recipe again, and get the same dict back.
+
+Cached rows are keyed by the recipe's name and code, the SQL of every
+installed model and the Testing defaults of every model, so changing any
+of them regenerates the rows. Primary keys are shifted past the rows
+already in the database when loading, along with the foreign keys and
+many-to-many rows pointing at them.
+
+Files unused for settings.TESTHELPER_FIXTURE_CACHE_MAX_AGE seconds (a week
+by default) are removed, then the least recently used ones until the
+cache fits in settings.TESTHELPER_FIXTURE_CACHE_MAX_BYTES (100MB by
+default). Set the TESTHELPER_REFRESH_FIXTURES environment variable to run
+every recipe again and rewrite its rows.
+"""
+import glob, gzip, os, time, types
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connection, models
+from django.db.models import get_models, get_model, Max
+from django.utils.hashcompat import md5_constructor
+
+from testhelper.bulk import _insert
+from testhelper.storage import get_cache_dir
+
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+
+def tracked_models():
+    "Models whose new rows can be told apart by their auto-incremented primary key."
+    return [m for m in get_models() if isinstance(m._meta.pk, models.AutoField) and not m._meta.proxy]
+
+def max_pk(model):
+    return model._default_manager.aggregate(last_pk=Max('pk'))['last_pk'] or 0
+
+def model_label(model):
+    return "%s.%s" % (model._meta.app_label, model._meta.object_name)
+
+# Keys regenerated in this process because of TESTHELPER_REFRESH_FIXTURES.
+_refreshed = set()
+
+def needs_refresh(key):
+    "Whether the rows cached for key should be regenerated once in this process."
+    if not os.environ.get('TESTHELPER_REFRESH_FIXTURES') or key in _refreshed:
+        return False
+    _refreshed.add(key)
+    return True
+
+_template_key = None
+
+def models_key():
+    """
+    Hash of the installed models' SQL and Testing defaults. The SQL is only
+    hashed once per process; the defaults, which tests may change, every time.
+    """
+    global _template_key
+    if _template_key is None:
+        from testhelper.runners.testdb import template_key
+        _template_key = template_key()
+    digest = md5_constructor(_template_key)
+    for model in get_models():
+        testing = getattr(model, 'Testing', None)
+        for name in ('defaults', 'post_save_defaults'):
+            values = getattr(testing, name, None) or {}
+            digest.update(repr(sorted(values.items())))
+    return digest.hexdigest()
+
+def recipe_key(name, recipe, extra=''):
+    "Hash identifying the rows recipe creates under name."
+    digest = md5_constructor("%s\n%s\n%s" % (name, models_key(), extra))
+    _update_code_digest(digest, getattr(recipe, 'func_code', None) or recipe.im_func.func_code)
+    return digest.hexdigest()
+
+def _update_code_digest(digest, code):
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _update_code_digest(digest, const)
+        else:
+            digest.update(repr(const))
+
+def record(run):
+    """
+    Calls run and returns what it returned along with the rows it added, as
+    a dict that load can insert again.
+    """
+    tracked = tracked_models()
+    before = dict([(m, max_pk(m)) for m in tracked])
+    result = run()
+
+    data = {'tables': [], 'join_tables': [], 'objects': {}}
+    for model in tracked:
+        if max_pk(model) <= before[model]:
+            continue
+        opts = model._meta
+        objects = model._default_manager.filter(pk__gt=before[model]).order_by('pk')
+        data['tables'].append({
+            'model': model_label(model),
+            'before': before[model],
+            'columns': [f.column for f in opts.local_fields],
+            'foreign_keys': dict([(f.column, model_label(f.rel.to)) for f in opts.local_fields if f.rel]),
+            'rows': [[_json_value(f.get_db_prep_save(getattr(o, f.attname))) for f in opts.local_fields]
+                for o in objects],
+        })
+        for field in opts.local_many_to_many:
+            if field.rel.through is not None:
+                continue
+            columns = [field.m2m_column_name(), field.m2m_reverse_name()]
+            cursor = connection.cursor()
+            cursor.execute("SELECT %s FROM %s WHERE %s > %%s" % (
+                ", ".join([connection.ops.quote_name(c) for c in columns]),
+                connection.ops.quote_name(field.m2m_db_table()),
+                connection.ops.quote_name(columns[0])), [before[model]])
+            data['join_tables'].append({
+                'table': field.m2m_db_table(),
+                'columns': columns,
+                'models': [model_label(model), model_label(field.rel.to)],
+                'rows': [list(row) for row in cursor.fetchall()],
+            })
+    for name, value in result.items():
+        data['objects'][name] = _reference(value)
+    return result, data
+
+def _json_value(value):
+    if value is None or isinstance(value, (basestring, int, long, float, bool)):
+        return value
+    return unicode(value)
+
+def _reference(value):
+    if isinstance(value, (list, tuple)):
+        return {'list': [_reference(v) for v in value]}
+    if isinstance(value, models.Model):
+        return {'model': model_label(value.__class__), 'pk': value.pk}
+    return {'value': value}
+
+def load(data):
+    """
+    Inserts the rows recorded by record, after the rows already in the
+    database, and returns the recorded objects fetched back.
+    """
+    offsets = {}
+    for table in data['tables']:
+        model = get_model(*table['model'].split('.'))
+        offsets[table['model']] = (table['before'], max_pk(model) - table['before'])
+
+    def shift(label, value):
+        before, offset = offsets.get(label, (None, 0))
+        if value is None or before is None or value <= before:
+            return value
+        return value + offset
+
+    for table in data['tables']:
+        opts = get_model(*table['model'].split('.'))._meta
+        targets = [table['foreign_keys'].get(c) for c in table['columns']]
+        targets[table['columns'].index(opts.pk.column)] = table['model']
+        rows = []
+        for row in table['rows']:
+            row = list(row)
+            for i, label in enumerate(targets):
+                if label is not None:
+                    row[i] = shift(label, row[i])
+            rows.append(row)
+        _insert(opts.db_table, table['columns'], rows)
+    for join_table in data['join_tables']:
+        source, target = join_table['models']
+        rows = [[shift(source, s), shift(target, t)] for s, t in join_table['rows']]
+        _insert(join_table['table'], join_table['columns'], rows)
+
+    loaded = [get_model(*table['model'].split('.')) for table in data['tables']]
+    for sql in connection.ops.sequence_reset_sql(no_style(), loaded):
+        connection.cursor().execute(sql)
+
+    instances = {}
+    result = {}
+    for name, reference in data['objects'].items():
+        result[name] = _resolve(reference, shift, instances)
+    return result
+
+def _resolve(reference, shift, instances):
+    if 'list' in reference:
+        return [_resolve(r, shift, instances) for r in reference['list']]
+    if 'model' in reference:
+        key = (reference['model'], shift(reference['model'], reference['pk']))
+        if key not in instances:
+            model = get_model(*reference['model'].split('.'))
+            instances[key] = model._default_manager.get(pk=key[1])
+        return instances[key]
+    return reference['value']
+
+class FixtureCache(object):
+    "The cached rows of every recipe, in the fixtures directory of the cache."
+    def __init__(self, directory=None, max_bytes=None, max_age=None):
+        self.directory = directory or os.path.join(get_cache_dir(), 'fixtures')
+        self.max_bytes = max_bytes or getattr(settings, 'TESTHELPER_FIXTURE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+        self.max_age = max_age or getattr(settings, 'TESTHELPER_FIXTURE_CACHE_MAX_AGE', DEFAULT_MAX_AGE)
+
+    def path(self, name, key):
+        return os.path.join(self.directory, "%s-%s.json.gz" % (name, key))
+
+    def get(self, name, key):
+        "The rows cached for name and key, or None."
+        path = self.path(name, key)
+        try:
+            f = gzip.open(path, 'rb')
+            try:
+                data = json.loads(f.read())
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return None
+        # Eviction goes by last use.
+        os.utime(path, None)
+        return data
+
+    def put(self, name, key, data):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = self.path(name, key)
+        temp_path = "%s.%s" % (path, os.getpid())
+        f = gzip.open(temp_path, 'wb')
+        try:
+            f.write(json.dumps(data, separators=(',', ':')))
+        finally:
+            f.close()
+        os.rename(temp_path, path)
+        self.evict()
+
+    def evict(self, now=None):
+        "Removes files unused for max_age seconds, then the oldest until under max_bytes."
+        now = now or time.time()
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, '*.json.gz')):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age:
+                os.remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum([size for mtime, size, path in entries])
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
@@ -0,0 +1,118 @@
+"""
+Allocators for the unique integers DjangoTestCase substitutes for #{ran}
+and #{ran_i} in Testing.defaults.
+
+Every allocator hands out a value in constant time and only remembers as
+much as it needs to keep those values unique until its next reset().
+"""
+import os
+import random
+
+from testhelper.seeds import get_worker
+
+class IndexAllocator(object):
+    "Hands out unique integers. Subclasses implement allocate() and reset()."
+    def __init__(self):
+        self.reset()
+
+    def allocate(self):
+        raise NotImplementedError
+
+    def reset(self):
+        pass
+
+    def mark_used(self, value):
+        "Keeps value, handed out by another allocator, from being handed out."
+        pass
+
+class RandomIndexAllocator(IndexAllocator):
+    """
+    Random unique integers between 1 and max_value, remembered in a set.
+
+    Values are drawn until a free one comes up. Once half of the range has
+    been handed out the free values are listed and drawn from directly, so
+    finding one takes constant time on average however full the range
+    gets. Raises ValueError when every value has been handed out.
+
+    Under the parallel runner each of the n workers only hands out the
+    values in the range congruent to its own number modulo n, so workers
+    never collide. worker and workers default to get_worker().
+    """
+    def __init__(self, max_value=99999, random=random, worker=None, workers=None):
+        self.max_value = max_value
+        self.random = random
+        if worker is None or workers is None:
+            worker, workers = get_worker()
+        self.worker, self.workers = worker, workers
+        # Values are handed out as slot * workers + worker + 1.
+        self.slots = len(xrange(worker, max_value, workers))
+        super(RandomIndexAllocator, self).__init__()
+
+    def allocate(self):
+        if self.free is None and len(self.used) * 2 >= self.slots:
+            self.free = [slot for slot in xrange(self.slots) if slot not in self.used]
+        if self.free is None:
+            slot = self.random.randrange(self.slots)
+            while slot in self.used:
+                slot = self.random.randrange(self.slots)
+            self.used.add(slot)
+        elif self.free:
+            i = self.random.randrange(len(self.free))
+            slot = self.free[i]
+            self.free[i] = self.free[-1]
+            self.free.pop()
+        else:
+            raise ValueError("Worker %s of %s has handed out all %s of its values between 1 and %s." % (
+                self.worker, self.workers, self.slots, self.max_value))
+        return slot * self.workers + self.worker + 1
+
+    def reset(self):
+        self.used = set()
+        self.free = None
+
+    def mark_used(self, value):
+        slot, worker = divmod(value - 1, self.workers)
+        if worker != self.worker or not 0 <= slot < self.slots:
+            return
+        if self.free is None:
+            self.used.add(slot)
+        elif slot in self.free:
+            self.free.remove(slot)
+
+class CounterIndexAllocator(IndexAllocator):
+    "Consecutive integers from start, remembering nothing but the next one."
+    def __init__(self, start=1):
+        self.start = start
+        super(CounterIndexAllocator, self).__init__()
+
+    def allocate(self):
+        value = self.next_value
+        self.next_value += 1
+        return value
+
+    def reset(self):
+        self.next_value = self.start
+
+    def mark_used(self, value):
+        if value >= self.next_value:
+            self.next_value = value + 1
+
+class PartitionedIndexAllocator(CounterIndexAllocator):
+    """
+    Consecutive integers inside a block of partition_size values owned by
+    one worker process, so parallel workers never hand out the same value.
+
+    worker defaults to the TESTHELPER_WORKER environment variable, which the
+    parallel runner sets for each of its processes, or 0.
+    """
+    def __init__(self, worker=None, partition_size=1000000):
+        if worker is None:
+            worker = int(os.environ.get('TESTHELPER_WORKER', 0))
+        self.worker = worker
+        self.partition_size = partition_size
+        super(PartitionedIndexAllocator, self).__init__(start=worker * partition_size + 1)
+
+    def allocate(self):
+        if self.next_value > (self.worker + 1) * self.partition_size:
+            raise ValueError("Worker %s has used all %s indexes in its partition." % (self.worker, self.partition_size))
+        return super(PartitionedIndexAllocator, self).allocate()
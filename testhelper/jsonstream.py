@@ -0,0 +1,277 @@
+"""
+Validates JSON incrementally, without building the document in memory.
+
+validate_json(response)                       # any iterable of chunks
+validate_json(content, required_keys=['results'], min_length=2)
+
+Content is fed in pieces of at most CHUNK_SIZE bytes, however large the
+chunks it comes in. The document is followed token by token with a small
+state machine; a nested value that ends within the current piece is scanned
+whole by the json module's C scanner and thrown away, while containers
+running on into the next piece, invalid values and values cut off by the
+end of a piece are followed token by token. Memory use is bounded by
+CHUNK_SIZE and the nesting depth, not by the size of the document. Bytes
+that aren't valid UTF-8 are rejected, as json.loads does. Errors are raised
+as InvalidJson, a ValueError with the byte offset of the first problem in
+its offset attribute.
+
+The optional shape checks look at the top level of the document only:
+required_keys lists keys the top-level object must have, and length,
+min_length and max_length bound the number of top-level items of an array
+or members of an object.
+"""
+import codecs, re
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+TOKEN = re.compile(r'''
+    (?P<space>[ \t\n\r]+)
+  | (?P<string>"(?:[^"\\\x00-\x1f]|\\["\\/bfnrt]|\\u[0-9a-fA-F]{4})*")
+  | (?P<number>-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?)
+  | (?P<literal>true|false|null)
+  | (?P<punctuation>[{}\[\]:,])
+''', re.VERBOSE)
+
+# What a token cut off by the end of a chunk may look like.
+PARTIAL_STRING = re.compile(r'"(?:[^"\\\x00-\x1f]|\\["\\/bfnrt]|\\u[0-9a-fA-F]{4})*(?:\\(?:u[0-9a-fA-F]{0,3})?)?\Z')
+PARTIAL_NUMBER = re.compile(r'-?(?:0|[1-9][0-9]*)?(?:\.[0-9]*)?(?:[eE][+-]?[0-9]*)?\Z')
+LITERALS = ('true', 'false', 'null')
+
+CHUNK_SIZE = 64 * 1024
+
+def _reject_constant(name):
+    raise ValueError("%s is not valid JSON" % name)
+
+scan_once = json.JSONDecoder(parse_constant=_reject_constant).scan_once
+
+# Parser states: what the next token may be.
+VALUE, FIRST_ITEM, FIRST_KEY, KEY, COLON, AFTER_VALUE, DONE = range(7)
+
+EXPECTED = {
+    VALUE: 'a value',
+    FIRST_ITEM: "a value or ']'",
+    FIRST_KEY: "a string key or '}'",
+    KEY: 'a string key',
+    COLON: "':'",
+    DONE: 'the end of the document',
+}
+
+class InvalidJson(ValueError):
+    def __init__(self, message, offset):
+        ValueError.__init__(self, "%s at byte %s" % (message, offset))
+        self.offset = offset
+
+class JsonValidator(object):
+    """
+    Feed it chunks of a JSON document, then call close(). Raises InvalidJson
+    as soon as the data seen so far can't be the start of a valid document.
+    After close(), root is 'object' or 'array' (or 'value' for a scalar
+    document) and length the number of its top-level items.
+    """
+    def __init__(self, required_keys=None):
+        self.required_keys = set(required_keys or ())
+        self.found_keys = set()
+        self.buffer = ''
+        self.offset = 0
+        self.state = VALUE
+        self.stack = []
+        self.root = None
+        self.length = 0
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.fed = 0
+
+    def feed(self, chunk):
+        for piece in iter_chunks(chunk):
+            self._check_encoding(piece, final=False)
+            self.buffer += piece
+            self._scan(final=False)
+
+    def close(self):
+        self._check_encoding('', final=True)
+        self._scan(final=True)
+        if self.state != DONE:
+            raise InvalidJson("Unexpected end of document, expected %s" % self._expected(), self.offset)
+
+    def _check_encoding(self, piece, final):
+        "Raises InvalidJson when piece, following what was fed before, isn't UTF-8."
+        pending = len(self.decoder.getstate()[0])
+        try:
+            self.decoder.decode(piece, final)
+        except UnicodeDecodeError, e:
+            raise InvalidJson("Invalid UTF-8 %r" % e.object[e.start:e.end], self.fed - pending + e.start)
+        self.fed += len(piece)
+
+    def _expected(self):
+        if self.state == AFTER_VALUE:
+            return "',' or '%s'" % (self.stack[-1] == '{' and '}' or ']')
+        return EXPECTED[self.state]
+
+    def _scan(self, final):
+        buffer = self.buffer
+        end = len(buffer)
+        pos = 0
+        match_token = TOKEN.match
+        stack = self.stack
+        while pos < end:
+            if stack and self.state in (VALUE, FIRST_ITEM) and buffer[pos] not in ' \t\n\r':
+                value_end = self._scan_value(buffer, pos, end, final)
+                if value_end is not None:
+                    pos = value_end
+                    continue
+            match = match_token(buffer, pos)
+            # A token near the end of the chunk may continue in the next one:
+            # "tr", "12" or "1." wait for more data.
+            if not final and (match is None or match.end() == end
+                    or match.lastgroup == 'number' and end - match.end() < 3):
+                if _is_partial(buffer, pos):
+                    break
+            if match is None:
+                raise InvalidJson("Invalid token %r" % buffer[pos:pos + 10], self.offset + pos)
+            kind = match.lastgroup
+            if kind != 'space':
+                self._token(kind, match.group(), self.offset + pos)
+            pos = match.end()
+        self.buffer = buffer[pos:]
+        self.offset += pos
+
+    def _scan_value(self, buffer, pos, end, final):
+        """
+        Scans a whole value nested in the document with the json module's
+        scanner. The buffer holds at most one piece and a cut off token, so
+        the value is no larger than that. Returns where the value ends, or
+        None to go on token by token: when there is no value at pos, when
+        it's invalid or cut off by the end of the piece, as a container
+        running on into the next piece is.
+        """
+        try:
+            value, value_end = scan_once(buffer, pos)
+        except (StopIteration, ValueError):
+            return None
+        if not final and end - value_end < 3 and not isinstance(value, (basestring, list, dict)):
+            # A number or literal may continue in the next chunk.
+            return None
+        if len(self.stack) == 1 and self.root == 'array':
+            self.length += 1
+        self.state = AFTER_VALUE
+        return value_end
+
+    def _token(self, kind, token, offset):
+        state = self.state
+        if kind == 'punctuation':
+            if token == ':' and state == COLON:
+                self.state = VALUE
+            elif token == ',' and state == AFTER_VALUE:
+                self.state = self.stack[-1] == '{' and KEY or VALUE
+            elif token in '{[' and state in (VALUE, FIRST_ITEM):
+                self._start_value(token)
+                self.stack.append(token)
+                self.state = token == '{' and FIRST_KEY or FIRST_ITEM
+            elif token == '}' and state in (FIRST_KEY, AFTER_VALUE) and self.stack[-1] == '{' \
+                    or token == ']' and state in (FIRST_ITEM, AFTER_VALUE) and self.stack[-1] == '[':
+                self.stack.pop()
+                self._end_value()
+            else:
+                self._unexpected(token, offset)
+        elif state in (FIRST_KEY, KEY):
+            if kind != 'string':
+                self._unexpected(token, offset)
+            if len(self.stack) == 1:
+                self.length += 1
+                if self.required_keys:
+                    key = json.loads(token)
+                    if key in self.required_keys:
+                        self.found_keys.add(key)
+            self.state = COLON
+        elif state in (VALUE, FIRST_ITEM):
+            self._start_value(token)
+            self._end_value()
+        else:
+            self._unexpected(token, offset)
+
+    def _start_value(self, token):
+        if not self.stack:
+            self.root = {'{': 'object', '[': 'array'}.get(token, 'value')
+        elif len(self.stack) == 1 and self.stack[0] == '[':
+            self.length += 1
+
+    def _end_value(self):
+        self.state = self.stack and AFTER_VALUE or DONE
+
+    def _unexpected(self, token, offset):
+        raise InvalidJson("Unexpected %r, expected %s" % (token[:10], self._expected()), offset)
+
+def _is_partial(buffer, pos):
+    "Whether buffer[pos:] could be the start of a token."
+    first = buffer[pos]
+    if first == '"':
+        return PARTIAL_STRING.match(buffer, pos) is not None
+    if first in '-0123456789':
+        return PARTIAL_NUMBER.match(buffer, pos) is not None
+    rest = buffer[pos:pos + 5]
+    for literal in LITERALS:
+        if literal.startswith(rest):
+            return True
+    return False
+
+def iter_chunks(content, chunk_size=CHUNK_SIZE):
+    """
+    Content, a string or an iterable of strings such as a response, in
+    UTF-8 encoded pieces of at most chunk_size bytes.
+    """
+    if isinstance(content, basestring):
+        content = [content]
+    for chunk in content:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        if len(chunk) <= chunk_size:
+            if chunk:
+                yield chunk
+            continue
+        for start in xrange(0, len(chunk), chunk_size):
+            yield chunk[start:start + chunk_size]
+
+def validate_json(content, required_keys=None, length=None, min_length=None, max_length=None):
+    """
+    Checks that content is a JSON document of the given shape and returns
+    the validator. Raises InvalidJson, a ValueError, when it isn't.
+    """
+    validator = JsonValidator(required_keys)
+    for chunk in iter_chunks(content):
+        validator.feed(chunk)
+    validator.close()
+
+    if validator.required_keys:
+        if validator.root != 'object':
+            raise InvalidJson("Expected an object with keys %s, got %s" % (
+                _keys(validator.required_keys), _article(validator.root)), 0)
+        missing = validator.required_keys - validator.found_keys
+        if missing:
+            raise InvalidJson("Missing required keys %s" % _keys(missing), 0)
+    if length is not None or min_length is not None or max_length is not None:
+        if validator.root not in ('object', 'array'):
+            raise InvalidJson("Expected an object or array, got a value", 0)
+        count = validator.length
+        if (length is not None and count != length
+                or min_length is not None and count < min_length
+                or max_length is not None and count > max_length):
+            raise InvalidJson("Top-level %s has %s items, expected %s" % (
+                validator.root, count, _bounds(length, min_length, max_length)), 0)
+    return validator
+
+def _keys(keys):
+    return ", ".join(sorted([repr(k) for k in keys]))
+
+def _article(root):
+    return root == 'array' and 'an array' or root == 'object' and 'an object' or 'a value'
+
+def _bounds(length, min_length, max_length):
+    if length is not None:
+        return str(length)
+    if max_length is None:
+        return "at least %s" % min_length
+    if min_length is None:
+        return "at most %s" % max_length
+    return "between %s and %s" % (min_length, max_length)
@@ -0,0 +1,176 @@
+"""
+Compiled versions of a model's Testing.defaults and post_save_defaults.
+
+Each value is classified once into an expander, so creating an object only
+has to run the expanders instead of searching every string for the #{ran},
+#{ran_i} and #{now} markers and trying to instantiate every value:
+
+    'Space Pilot #{ran}'  -> IndexSubstitution, the object index as text
+    '#{ran_i}'            -> IntegerIndex, the object index as an int
+    '#{now}'              -> Timestamp, datetime.datetime.now()
+    Category              -> RelatedFactory, a saved related object
+    anything else         -> Literal, used as is
+
+Plans are cached per model and recompiled when the Testing class or the
+contents of its defaults change. So are RelationGraphs, the models a
+model's defaults create through related model classes, in the order they
+have to be created.
+"""
+import datetime
+
+from django.db import models
+
+class Literal(object):
+    def __init__(self, value):
+        self.value = value
+
+    def expand(self, testcase, index):
+        return self.value
+
+class IndexSubstitution(object):
+    marker = "#{ran}"
+
+    def __init__(self, template):
+        self.parts = template.split(self.marker)
+
+    def expand(self, testcase, index):
+        return str(index).join(self.parts)
+
+class IntegerIndex(IndexSubstitution):
+    marker = "#{ran_i}"
+
+    def expand(self, testcase, index):
+        return int(str(index).join(self.parts))
+
+class Timestamp(object):
+    def expand(self, testcase, index):
+        return datetime.datetime.now()
+
+class RelatedFactory(object):
+    "The related object for owner.key, which the testcase creates or shares."
+    def __init__(self, model, owner=None, key=None):
+        self.model = model
+        self.owner = owner
+        self.key = key
+
+    def expand(self, testcase, index):
+        return testcase.create_related_object(self.owner, self.key, self.model)
+
+class CyclicDefaults(ValueError):
+    pass
+
+def is_model_class(value):
+    return isinstance(value, type) and issubclass(value, models.Model)
+
+def compile_value(value, owner=None, key=None):
+    "Returns the expander for a single default or override value."
+    if hasattr(value, "startswith"):
+        if IndexSubstitution.marker in value:
+            return IndexSubstitution(value)
+        elif IntegerIndex.marker in value:
+            return IntegerIndex(value)
+        elif "#{now}" in value:
+            return Timestamp()
+    elif is_model_class(value):
+        return RelatedFactory(value, owner, key)
+    return Literal(value)
+
+def compile_values(values, owner=None):
+    return [(key, compile_value(value, owner, key)) for key, value in values.items()]
+
+class DefaultsPlan(object):
+    """
+    The expanders for one model. post_save_defaults is None when the model
+    has no Testing.post_save_defaults, which means create_object doesn't
+    need to save the object.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.testing, self.source_defaults, self.source_post_save_defaults = _read_testing(model)
+        self.defaults = compile_values(self.source_defaults, model)
+        if self.source_post_save_defaults is None:
+            self.post_save_defaults = None
+        else:
+            self.post_save_defaults = compile_values(self.source_post_save_defaults, model)
+        self.relations = [(key, expander.model) for key, expander in self.defaults + (self.post_save_defaults or [])
+            if isinstance(expander, RelatedFactory)]
+
+    def is_current(self, model):
+        testing = getattr(model, 'Testing', None)
+        return (testing is self.testing
+            and (getattr(testing, 'defaults', None) or {}) == self.source_defaults
+            and getattr(testing, 'post_save_defaults', None) == self.source_post_save_defaults)
+
+    def expand_defaults(self, testcase, index, overrides=None):
+        "Values for the model's constructor, with overrides applied."
+        values = {}
+        if overrides:
+            expanders = dict(self.defaults)
+            expanders.update(compile_values(overrides, self.model))
+            expanders = expanders.items()
+        else:
+            expanders = self.defaults
+        for key, expander in expanders:
+            values[key] = expander.expand(testcase, index)
+        return values
+
+    def expand_post_save_defaults(self, testcase, index):
+        return [(key, expander.expand(testcase, index)) for key, expander in self.post_save_defaults]
+
+def _read_testing(model):
+    testing = getattr(model, 'Testing', None)
+    defaults = getattr(testing, 'defaults', None) or {}
+    post_save_defaults = getattr(testing, 'post_save_defaults', None)
+    if post_save_defaults is not None:
+        post_save_defaults = post_save_defaults.copy()
+    return testing, defaults.copy(), post_save_defaults
+
+_plans = {}
+
+def get_plan(model):
+    "Returns the compiled DefaultsPlan for model, recompiling it if stale."
+    plan = _plans.get(model)
+    if plan is None or not plan.is_current(model):
+        plan = _plans[model] = DefaultsPlan(model)
+    return plan
+
+class RelationGraph(object):
+    """
+    Every model the defaults of model create through related model classes,
+    directly or not. order lists them, model last, so that each comes after
+    the models it needs. Raises CyclicDefaults when the defaults would keep
+    creating each other forever.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.plans = {}
+        self.order = []
+        self._visit(model, [])
+
+    def _visit(self, model, path):
+        plan = get_plan(model)
+        for key, related in plan.relations:
+            chain = path + [(model, key)]
+            if related in [m for m, k in chain]:
+                start = [m for m, k in chain].index(related)
+                raise CyclicDefaults("Testing defaults create each other forever: %s" % " -> ".join(
+                    ["%s.%s" % (m.__name__, k) for m, k in chain[start:]] + [related.__name__]))
+            if related not in self.plans:
+                self._visit(related, chain)
+        self.plans[model] = plan
+        self.order.append(model)
+
+    def is_current(self):
+        for model, plan in self.plans.items():
+            if get_plan(model) is not plan:
+                return False
+        return True
+
+_graphs = {}
+
+def get_graph(model):
+    "Returns the RelationGraph of model, rebuilding it if any of its plans changed."
+    graph = _graphs.get(model)
+    if graph is None or not graph.is_current():
+        graph = _graphs[model] = RelationGraph(model)
+    return graph
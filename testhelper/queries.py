@@ -0,0 +1,197 @@
+import re, sys, threading
+
+from django.conf import settings
+from django.db import connection, reset_queries
+from django.db.backends.util import CursorDebugWrapper
+from django.core import signals
+
+_reset_lock = threading.Lock()
+_reset_disabled = 0
+
+def _disable_query_reset():
+    """
+    Stops request_started from emptying connection.queries, so requests
+    made through the test client while capturing are still recorded.
+    """
+    global _reset_disabled
+    _reset_lock.acquire()
+    try:
+        if not _reset_disabled:
+            signals.request_started.disconnect(reset_queries)
+        _reset_disabled += 1
+    finally:
+        _reset_lock.release()
+
+def _enable_query_reset():
+    global _reset_disabled
+    _reset_lock.acquire()
+    try:
+        _reset_disabled -= 1
+        if not _reset_disabled:
+            signals.request_started.connect(reset_queries)
+    finally:
+        _reset_lock.release()
+
+class CaptureCursorWrapper(CursorDebugWrapper):
+    """
+    A CursorDebugWrapper also recording the SQL of each query before its
+    parameters are filled in, as 'template', and the parameters as 'params'.
+    The 'sql' Django logs has string parameters filled in without quotes.
+    """
+    def execute(self, sql, params=()):
+        try:
+            return CursorDebugWrapper.execute(self, sql, params)
+        finally:
+            self.db.queries[-1].update(template=sql, params=params)
+
+    def executemany(self, sql, param_list):
+        try:
+            return CursorDebugWrapper.executemany(self, sql, param_list)
+        finally:
+            self.db.queries[-1].update(template=sql, params=param_list)
+
+def _install_debug_cursor(db):
+    """
+    Makes db.cursor() always return a CaptureCursorWrapper, even with
+    settings.DEBUG turned off, without touching DEBUG itself.
+    """
+    depth = getattr(db, '_capture_depth', 0)
+    if not depth:
+        real_cursor = db.cursor
+        def cursor():
+            c = real_cursor()
+            if isinstance(c, CaptureCursorWrapper):
+                return c
+            if isinstance(c, CursorDebugWrapper):
+                c = c.cursor
+            return CaptureCursorWrapper(c, db)
+        db.cursor = cursor
+    db._capture_depth = depth + 1
+
+def _uninstall_debug_cursor(db):
+    db._capture_depth -= 1
+    if not db._capture_depth:
+        del db.cursor
+
+class CaptureQueries(object):
+    """
+    Context manager that records every query run against the database
+    connection while it is active, whether or not settings.DEBUG is on.
+
+    Usage:
+
+    with CaptureQueries() as queries:
+        Article.objects.count()
+    print len(queries), queries.total_time
+
+    Each captured query is a dict with 'sql' and 'time' keys, as found in
+    django.db.connection.queries, plus the 'template' and 'params' it was
+    run with. Captures can be nested.
+    """
+    def __init__(self, db=None):
+        self.db = db or connection
+        self.queries = []
+        self._start = None
+        self._active = False
+
+    def __enter__(self):
+        _disable_query_reset()
+        _install_debug_cursor(self.db)
+        self._start = len(self.db.queries)
+        self._active = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.queries = self.db.queries[self._start:]
+        self._active = False
+        # Without DEBUG nothing else wants these queries, and nothing resets
+        # connection.queries either, so the outermost capture drops them.
+        if self.db._capture_depth == 1 and not settings.DEBUG:
+            del self.db.queries[self._start:]
+        _uninstall_debug_cursor(self.db)
+        _enable_query_reset()
+        return False
+
+    def __len__(self):
+        return len(self.captured)
+
+    def __iter__(self):
+        return iter(self.captured)
+
+    def __getitem__(self, index):
+        return self.captured[index]
+
+    def _get_captured(self):
+        "Queries recorded so far, including while the capture is still active."
+        if self._active:
+            return self.db.queries[self._start:]
+        return self.queries
+    captured = property(_get_captured)
+
+    def _get_count(self):
+        return len(self.captured)
+    count = property(_get_count)
+
+    def _get_total_time(self):
+        "Total time spent in the captured queries, in seconds."
+        return sum([float(q['time']) for q in self.captured])
+    total_time = property(_get_total_time)
+
+_string_literal = re.compile(r"'(?:[^']|'')*'")
+_number_literal = re.compile(r"\b\d+(?:\.\d+)?\b")
+_value_list = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_whitespace = re.compile(r"\s+")
+
+def normalize_sql(sql):
+    """
+    Replaces the literal values and %s placeholders in sql with ? and lists
+    of them with (...), so that queries differing only by their parameters
+    compare equal.
+    """
+    sql = _string_literal.sub("?", sql)
+    sql = sql.replace("%s", "?")
+    sql = _number_literal.sub("?", sql)
+    sql = _value_list.sub("(...)", sql)
+    return _whitespace.sub(" ", sql).strip()
+
+def group_queries(queries):
+    """
+    Returns (normalized sql, count) pairs for queries, most repeated first.
+    Queries are grouped by their SQL template where it was captured.
+    """
+    counts = {}
+    for query in queries:
+        key = normalize_sql(query.get('template') or query['sql'])
+        counts[key] = counts.get(key, 0) + 1
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+def duplicate_queries(queries, max_repeats=1):
+    "The groups of queries that ran more than max_repeats times, a sign of N+1 queries."
+    return [(sql, count) for sql, count in group_queries(queries) if count > max_repeats]
+
+# Query totals for each test run with DjangoTestCase.log_queries on:
+# test id -> (number of queries, seconds spent in them).
+query_log = {}
+
+def log_test_queries(test_id, queries):
+    query_log[test_id] = (len(queries), queries.total_time)
+
+def print_query_summary(log=None, timings=None, limit=10, stream=None):
+    """
+    Writes the tests with the most queries and the most time spent in
+    queries. timings, a list of (test id, class name, seconds) as recorded
+    by the timing runner, adds the slowest tests overall.
+    """
+    if log is None:
+        log = query_log
+    stream = stream or sys.stderr
+    if timings:
+        stream.write("\nSlowest tests:\n")
+        for test_id, class_name, seconds in sorted(timings, key=lambda t: -t[2])[:limit]:
+            stream.write("%8.3fs  %s\n" % (seconds, test_id))
+    stream.write("\nMost queries:\n")
+    for test_id, (count, seconds) in sorted(log.items(), key=lambda item: -item[1][0])[:limit]:
+        stream.write("%8d  %s\n" % (count, test_id))
+    stream.write("\nMost time in queries:\n")
+    for test_id, (count, seconds) in sorted(log.items(), key=lambda item: -item[1][1])[:limit]:
+        stream.write("%8.3fs  %s\n" % (seconds, test_id))
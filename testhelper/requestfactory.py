@@ -73,4 +73,129 @@ class RequestFactory(Client):
         }
         r.update(extra)
 
-        return self._bare_request(**r)
\ No newline at end of file
+        return self._bare_request(**r)
+
+class LazyPayload(object):
+    """
+    Stands in for wsgi.input, only wrapping the content in a FakePayload
+    once a view actually reads the request body.
+    """
+    def __init__(self, content):
+        self.content = content
+        self._payload = None
+
+    def read(self, num_bytes=None):
+        if self._payload is None:
+            self._payload = FakePayload(self.content)
+        return self._payload.read(num_bytes)
+
+
+class SlimRequestFactory(object):
+    """
+    A cheaper RequestFactory for building large numbers of requests, with
+    the same get_request() and post_request() methods.
+
+    It doesn't subclass Client, so there is no handler or cookie jar to set
+    up. The environ shared by every request is computed once and copied,
+    identical multipart POST payloads are only encoded once, and wsgi.input
+    isn't created until the request body is read.
+
+    Usage:
+
+    rf = SlimRequestFactory()
+    get_request = rf.get_request('/hello/')
+    post_request = rf.post_request('/submit/', {'foo': 'bar'})
+    """
+    # Number of encoded multipart payloads kept before the cache is emptied.
+    multipart_cache_size = 256
+
+    def __init__(self, **defaults):
+        self.defaults = defaults
+        self.base_environ = {
+            'HTTP_COOKIE': '',
+            'PATH_INFO': '/',
+            'QUERY_STRING': '',
+            'REQUEST_METHOD': 'GET',
+            'SCRIPT_NAME': '',
+            'SERVER_NAME': 'testserver',
+            'SERVER_PORT': 80,
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+        }
+        # As with the test client, defaults replace the base environ and the
+        # keys each kind of request sets replace the defaults.
+        self.base_environ.update(defaults)
+        self.get_environ = self.base_environ.copy()
+        self.get_environ.update({
+            'CONTENT_LENGTH': None,
+            'CONTENT_TYPE': 'text/html; charset=utf-8',
+            'REQUEST_METHOD': 'GET',
+        })
+        self.post_environ = self.base_environ.copy()
+        self.post_environ['REQUEST_METHOD'] = 'POST'
+        self._multipart_cache = {}
+
+    def _bare_request(self, **request):
+        environ = self.base_environ.copy()
+        environ.update(request)
+        return WSGIRequest(environ)
+
+    def get_request(self, path, data={}, **extra):
+        """
+        Builds a GET request.
+        """
+        environ = self.get_environ.copy()
+        environ['PATH_INFO'] = urllib.unquote(path)
+        if data:
+            environ['QUERY_STRING'] = urlencode(data, doseq=True)
+        if extra:
+            environ.update(extra)
+        return WSGIRequest(environ)
+
+    def post_request(self, path, data={}, content_type=MULTIPART_CONTENT, **extra):
+        """
+        Builds a POST request.
+        """
+        if content_type is MULTIPART_CONTENT:
+            post_data = self.encode_multipart(data)
+        else:
+            post_data = data
+
+        environ = self.post_environ.copy()
+        environ['CONTENT_LENGTH'] = len(post_data)
+        environ['CONTENT_TYPE'] = content_type
+        environ['PATH_INFO'] = urllib.unquote(path)
+        environ['wsgi.input'] = LazyPayload(post_data)
+        if extra:
+            environ.update(extra)
+        return WSGIRequest(environ)
+
+    def encode_multipart(self, data):
+        """
+        encode_multipart(BOUNDARY, data), remembered for data made only of
+        strings and lists of strings. Payloads with files are encoded every
+        time.
+        """
+        key = self._multipart_key(data)
+        if key is None:
+            return encode_multipart(BOUNDARY, data)
+        try:
+            return self._multipart_cache[key]
+        except KeyError:
+            if len(self._multipart_cache) >= self.multipart_cache_size:
+                self._multipart_cache.clear()
+            post_data = self._multipart_cache[key] = encode_multipart(BOUNDARY, data)
+            return post_data
+
+    def _multipart_key(self, data):
+        items = []
+        for key, value in data.items():
+            if isinstance(value, (list, tuple)):
+                for item in value:
+                    if not isinstance(item, basestring):
+                        return None
+                value = tuple(value)
+            elif not isinstance(value, basestring):
+                return None
+            items.append((key, value))
+        items.sort()
+        return tuple(items)
@@ -0,0 +1,70 @@
+"""
+Ordering a suite so that the tests most likely to fail run first.
+
+Classes with a test that failed in the last run come first, then classes
+from test modules changed since the last run, then everything else in
+suite order. Tests of one TestCase class stay together, so class level
+fixtures still run once, and within a class the failed tests go first.
+"""
+import os, sys
+import unittest
+
+from testhelper.runners.sharding import flatten_suite, group_tests
+
+def test_file(test):
+    "The source file test was defined in, or None."
+    doctest = getattr(test, '_dt_test', None)
+    if doctest is not None:
+        path = doctest.filename
+    else:
+        path = getattr(sys.modules.get(test.__class__.__module__), '__file__', None)
+    if path and path[-4:] in ('.pyc', '.pyo'):
+        path = path[:-1]
+    return path
+
+def file_mtime(path, mtimes=None):
+    "The modification time of path, or None when it can't be read."
+    if mtimes is not None and path in mtimes:
+        return mtimes[path]
+    try:
+        mtime = os.path.getmtime(path)
+    except (OSError, TypeError):
+        mtime = None
+    if mtimes is not None:
+        mtimes[path] = mtime
+    return mtime
+
+def prioritize(suite, history):
+    "Returns suite reordered by the failures and last run time in history."
+    failed = set(history.failed)
+    mtimes = {}
+
+    def rank(tests):
+        if [t for t in tests if t.id() in failed]:
+            return 0
+        if history.last_run is not None:
+            mtime = file_mtime(test_file(tests[0]), mtimes)
+            if mtime is not None and mtime > history.last_run:
+                return 1
+        return 2
+
+    groups = group_tests(suite)
+    ranks = [rank(tests) for tests in groups]
+    ordered = unittest.TestSuite()
+    for i in sorted(range(len(groups)), key=lambda i: (ranks[i], i)):
+        tests = groups[i]
+        if ranks[i] == 0:
+            tests = [t for t in tests if t.id() in failed] + [t for t in tests if t.id() not in failed]
+        ordered.addTests(tests)
+    return ordered
+
+def select_failed(suite, history):
+    """
+    Returns the tests of suite that failed in the last run, or suite itself
+    when none of them did.
+    """
+    failed = set(history.failed)
+    tests = [t for t in flatten_suite(suite) if t.id() in failed]
+    if not tests:
+        return suite
+    return unittest.TestSuite(tests)
@@ -0,0 +1,188 @@
+import os, Queue, sys, traceback
+from StringIO import StringIO
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+from django.conf import settings
+from django.db.backends.creation import TEST_DATABASE_PREFIX
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from testhelper.queries import query_log, print_query_summary
+from testhelper.seeds import get_run_seed
+from testhelper.runners.ordering import prioritize, select_failed
+from testhelper.runners.quiet import quieter, build_test_suite, shard_suite
+from testhelper.runners.sharding import flatten_suite, split_suite
+from testhelper.runners.testdb import create_test_db, ensure_template, templates_enabled
+from testhelper.runners.timing import TimingTestRunner, TimingHistory
+
+def parallel(test_labels, verbosity=1, interactive=True, extra_tests=[], workers=None, shard=None,
+        failfast=False, last_failed=False, shard_timings=None):
+    """
+    Runs the same tests as quieter, split across worker processes.
+
+    Tests of one TestCase class always run in the same worker, and workers
+    get about the same amount of work according to the timing history,
+    which is updated with the timings of this run. Each worker
+    creates and destroys its own test database: a separate in-memory or
+    file database for sqlite3, and a database named after the worker for
+    the other backends. Workers see their number in the TESTHELPER_WORKER
+    environment variable, and their count in TESTHELPER_WORKERS, which
+    random index allocators use to hand out disjoint values. All workers
+    share the run seed. With settings.TESTHELPER_TEST_DB_TEMPLATE on,
+    the template is built once up front and every worker copies it.
+
+    Each worker runs its tests in quieter's order, previous failures first,
+    and with failfast stops at its own first failure. last_failed only runs
+    the tests that failed last time, and shard and shard_timings pick a
+    node's shard, as in quieter.
+
+    workers defaults to the number of CPUs. Without the multiprocessing
+    module (Python 2.5) the tests run serially through quieter.
+
+    Returns the number of tests that failed.
+    """
+    if multiprocessing is None or workers == 1:
+        return quieter(test_labels, verbosity, interactive, extra_tests, shard=shard,
+            failfast=failfast, last_failed=last_failed, shard_timings=shard_timings)
+    workers = workers or multiprocessing.cpu_count()
+
+    setup_test_environment()
+
+    settings.DEBUG = False
+    suite = build_test_suite(test_labels, extra_tests)
+    history = TimingHistory()
+    shard = shard or os.environ.get('TESTHELPER_SHARD')
+    if shard:
+        suite = shard_suite(suite, shard, shard_timings)
+    if last_failed or os.environ.get('TESTHELPER_LAST_FAILED'):
+        suite = select_failed(suite, history)
+    shards = [prioritize(s, history) for s in split_suite(suite, workers, history) if s.countTestCases()]
+    failfast = failfast or bool(os.environ.get('TESTHELPER_FAILFAST'))
+    if templates_enabled():
+        ensure_template(max(verbosity - 1, 0))
+
+    # Forked workers inherit the shards and the environment, so nothing has
+    # to be pickled but the results they send back.
+    get_run_seed()
+    os.environ['TESTHELPER_WORKERS'] = str(len(shards))
+    collected = run_shards(shards, verbosity, failfast)
+
+    timings, failed_ids = [], []
+    for worker_result in collected:
+        failed_ids.extend([test_id for test_id, tb in worker_result[2] + worker_result[3]])
+        timings.extend(worker_result[-2])
+        query_log.update(worker_result[-1])
+    history.update(timings, failed_ids)
+    history.save()
+
+    teardown_test_environment()
+
+    del os.environ['TESTHELPER_WORKERS']
+    failed = report(collected, verbosity)
+    if query_log:
+        print_query_summary(timings=timings)
+    return failed
+
+def run_shards(shards, verbosity=1, failfast=False):
+    "Runs each shard in a worker process of its own and returns their results."
+    results = multiprocessing.Queue()
+    processes = []
+    for worker, shard in enumerate(shards):
+        process = multiprocessing.Process(target=run_shard, args=(worker, shard, verbosity, results, failfast))
+        process.start()
+        processes.append(process)
+    collected = collect_results(results, processes, shards)
+    for process in processes:
+        process.join()
+    return collected
+
+def collect_results(results, processes, shards, poll=0.5):
+    """
+    Gets the result of every worker from the results queue. A worker that
+    died without putting one there, killed or crashed, gets an error result
+    for its whole shard instead of leaving the run waiting forever.
+    """
+    collected = {}
+    while len(collected) < len(processes):
+        try:
+            worker_result = results.get(timeout=poll)
+        except Queue.Empty:
+            dead = [worker for worker, process in enumerate(processes)
+                if worker not in collected and not process.is_alive()]
+            if not dead:
+                continue
+            # A result put just before the worker exited may still be on its way.
+            try:
+                while True:
+                    worker_result = results.get(timeout=poll)
+                    collected[worker_result[0]] = worker_result
+            except Queue.Empty:
+                pass
+            for worker in dead:
+                if worker not in collected:
+                    collected[worker] = dead_worker_result(worker, processes[worker].exitcode, shards[worker])
+        else:
+            collected[worker_result[0]] = worker_result
+    return collected.values()
+
+def dead_worker_result(worker, exitcode, shard):
+    "The result of a worker that exited before reporting one, failing its shard."
+    message = "Worker %s exited with code %s before reporting the results of:\n%s\n" % (
+        worker, exitcode, "\n".join([test.id() for test in flatten_suite(shard)]))
+    return (worker, 0, [], [("worker %s" % worker, message)], message, [], {})
+
+def use_worker_database(worker):
+    "Points the test database settings at a database of worker's own."
+    if settings.DATABASE_ENGINE == 'sqlite3':
+        # In-memory databases are already private to each process.
+        if settings.TEST_DATABASE_NAME and settings.TEST_DATABASE_NAME != ':memory:':
+            settings.TEST_DATABASE_NAME = '%s_%s' % (settings.TEST_DATABASE_NAME, worker)
+    else:
+        name = settings.TEST_DATABASE_NAME or TEST_DATABASE_PREFIX + settings.DATABASE_NAME
+        settings.TEST_DATABASE_NAME = '%s_%s' % (name, worker)
+
+def run_shard(worker, suite, verbosity, results, failfast=False):
+    """
+    Runs suite in a worker process against a fresh test database and puts
+    (worker, tests run, failures, errors, output, timings, query log) on
+    the results queue, with failures and errors as (test id, traceback) pairs.
+    """
+    stream = StringIO()
+    try:
+        os.environ['TESTHELPER_WORKER'] = str(worker)
+        from django.db import connection
+        # Never reuse the parent's connection from inside the child.
+        connection.connection = None
+        use_worker_database(worker)
+
+        db_verbosity = max(verbosity - 1, 0)
+        old_name = settings.DATABASE_NAME
+        create_test_db(db_verbosity, autoclobber=True)
+        runner = TimingTestRunner(stream=stream, verbosity=verbosity, failfast=failfast)
+        result = runner.run(suite)
+        connection.creation.destroy_test_db(old_name, db_verbosity)
+
+        failures = [(test.id(), tb) for test, tb in result.failures]
+        errors = [(test.id(), tb) for test, tb in result.errors]
+        results.put((worker, result.testsRun, failures, errors, stream.getvalue(), runner.timings, query_log))
+    except:
+        stream.write(traceback.format_exc())
+        results.put((worker, 0, [], [("worker %s" % worker, traceback.format_exc())], stream.getvalue(), [], {}))
+
+def report(collected, verbosity, stream=None):
+    "Writes the output of every worker in order and returns failures + errors."
+    stream = stream or sys.stderr
+    collected.sort()
+    tests_run = failed = 0
+    for worker, count, failures, errors, output, timings, log in collected:
+        tests_run += count
+        failed += len(failures) + len(errors)
+        if verbosity:
+            stream.write("Worker %s:\n%s\n" % (worker, output))
+        elif failures or errors:
+            stream.write(output)
+    stream.write("Ran %s tests in %s workers, %s failed.\n" % (tests_run, len(collected), failed))
+    return failed
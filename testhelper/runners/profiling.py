@@ -0,0 +1,117 @@
+"""
+Opt-in profiling of every test run by the quieter runner.
+
+Each test runs under its own cProfile profiler and, where the tracemalloc
+module exists, with memory tracing on. With a threshold, only tests that
+took longer than that many seconds are kept. The kept profiles are merged
+into one pstats file in the cache directory, readable with pstats or any
+profile viewer, and summed up at the end of the run: slowest tests,
+hottest functions and the lines allocating the most memory.
+
+Nothing here is used unless profiling is asked for, so runs without it
+pay nothing.
+"""
+import cProfile, pstats, sys
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from testhelper.runners.timing import TimingTestResult, TimingTestRunner
+from testhelper.storage import cache_path
+
+class TestProfiles(object):
+    """
+    The profiles kept during a run. tests lists (test id, seconds, peak
+    bytes), with peak bytes None without tracemalloc, and allocations maps
+    'file:line' to the most bytes it held during any one test.
+    """
+    def __init__(self, threshold=0, top=10):
+        self.threshold = threshold
+        self.top = top
+        self.stats = None
+        self.tests = []
+        self.allocations = {}
+
+    def add(self, test_id, seconds, profile, peak=None, snapshot=None):
+        if seconds < self.threshold:
+            return
+        self.tests.append((test_id, seconds, peak))
+        if self.stats is None:
+            self.stats = pstats.Stats(profile)
+        else:
+            self.stats.add(profile)
+        if snapshot is not None:
+            for statistic in snapshot.statistics('lineno')[:self.top]:
+                frame = statistic.traceback[0]
+                site = "%s:%s" % (frame.filename, frame.lineno)
+                self.allocations[site] = max(self.allocations.get(site, 0), statistic.size)
+
+    def save(self, path=None):
+        "Writes the merged profile to path, profile.pstats in the cache directory by default."
+        path = path or cache_path('profile.pstats')
+        if self.stats is not None:
+            self.stats.dump_stats(path)
+        return path
+
+    def report(self, stream=None, path=None):
+        stream = stream or sys.stderr
+        stream.write("\nProfiled %s tests" % len(self.tests))
+        if self.threshold:
+            stream.write(" slower than %ss" % self.threshold)
+        stream.write(", merged profile in %s\n" % path)
+        if not self.tests:
+            return
+
+        stream.write("\nSlowest profiled tests:\n")
+        for test_id, seconds, peak in sorted(self.tests, key=lambda t: -t[1])[:self.top]:
+            if peak is None:
+                stream.write("%8.3fs  %s\n" % (seconds, test_id))
+            else:
+                stream.write("%8.3fs %8dKB  %s\n" % (seconds, peak // 1024, test_id))
+
+        stream.write("\nHottest functions:\n")
+        self.stats.stream = stream
+        self.stats.sort_stats('cumulative').print_stats(self.top)
+
+        stream.write("Largest allocators:\n")
+        if tracemalloc is None:
+            stream.write("  tracemalloc is not available on this Python\n")
+        for site, size in sorted(self.allocations.items(), key=lambda item: -item[1])[:self.top]:
+            stream.write("%8dKB  %s\n" % (size // 1024, site))
+
+class ProfilingTestResult(TimingTestResult):
+    "A TimingTestResult profiling every test into profiles."
+    def __init__(self, stream, descriptions, verbosity, timings, profiles):
+        TimingTestResult.__init__(self, stream, descriptions, verbosity, timings)
+        self.profiles = profiles
+
+    def startTest(self, test):
+        TimingTestResult.startTest(self, test)
+        if tracemalloc is not None:
+            tracemalloc.start()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stopTest(self, test):
+        self._profile.disable()
+        peak = snapshot = None
+        if tracemalloc is not None:
+            peak = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        TimingTestResult.stopTest(self, test)
+        test_id, class_name, seconds = self.timings[-1]
+        self.profiles.add(test_id, seconds, self._profile, peak, snapshot)
+        del self._profile
+
+class ProfilingTestRunner(TimingTestRunner):
+    def __init__(self, stream=sys.stderr, descriptions=1, verbosity=1, failfast=False, threshold=0, top=10):
+        TimingTestRunner.__init__(self, stream, descriptions, verbosity, failfast)
+        self.profiles = TestProfiles(threshold, top)
+
+    def _makeResult(self):
+        result = ProfilingTestResult(self.stream, self.descriptions, self.verbosity, self.timings, self.profiles)
+        result.failfast = self.failfast
+        return result
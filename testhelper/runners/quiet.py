@@ -1,6 +1,55 @@
-from django.test.simple import *
+import os, sys
+import unittest
+from optparse import OptionParser
 
-def quieter(test_labels, verbosity=1, interactive=True, extra_tests=[]):
+from django.conf import settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from testhelper.queries import query_log, print_query_summary
+from testhelper.runners.ordering import prioritize, select_failed
+from testhelper.runners.sharding import parse_shard, select_shard
+from testhelper.runners.testdb import create_test_db
+from testhelper.runners.timing import TimingTestRunner, TimingHistory
+
+def build_test_suite(test_labels, extra_tests=[]):
+    """
+    Builds the suite for test_labels (every installed app when empty) plus
+    extra_tests, the same way django.test.simple.run_tests does. Only the
+    apps named by the labels get their tests collected.
+    """
+    from django.db.models import get_app, get_apps
+    from django.test.simple import build_suite, build_test
+    suite = unittest.TestSuite()
+    
+    if test_labels:
+        for label in test_labels:
+            if '.' in label:
+                suite.addTest(build_test(label))
+            else:
+                app = get_app(label)
+                suite.addTest(build_suite(app))
+    else:
+        for app in get_apps():
+            suite.addTest(build_suite(app))
+    
+    for test in extra_tests:
+        suite.addTest(test)
+
+    return suite
+
+def shard_suite(suite, shard, shard_timings=None):
+    """
+    The part of suite in shard, given as 'i/n'. The split is balanced by the
+    timing history at shard_timings, or in the TESTHELPER_SHARD_TIMINGS
+    environment variable, which every node has to share. This node's own
+    history never plays a part, since other nodes' histories differ.
+    """
+    shard_timings = shard_timings or os.environ.get('TESTHELPER_SHARD_TIMINGS')
+    history = shard_timings and TimingHistory(shard_timings) or None
+    return select_shard(suite, parse_shard(shard), history)
+
+def quieter(test_labels, verbosity=1, interactive=True, extra_tests=[], shard=None,
+        profile=False, profile_threshold=0, failfast=False, last_failed=False, shard_timings=None):
     """
     Note: Adapted from django.test.simple.run_tests, lowering verbosity level of db creation/teardown
     
@@ -18,6 +67,29 @@ def quieter(test_labels, verbosity=1, interactive=True, extra_tests=[]):
     
     A list of 'extra' tests may also be provided; these tests
     will be added to the test suite.
+
+    With settings.TESTHELPER_TEST_DB_TEMPLATE on, the sqlite test database
+    is copied from a template instead of being built with syncdb.
+
+    Tests logging their queries (DjangoTestCase.log_queries) are summed
+    up at the end: slowest tests, most queries and most time in queries.
+
+    The wall time of every test is recorded in the timing history. When
+    shard is given as 'i/n', or in the TESTHELPER_SHARD environment
+    variable, only the i-th of n shards is run, balanced by the shared
+    history at shard_timings when there is one; see shard_suite.
+
+    The history also records which tests failed. Classes with a test that
+    failed last time run first, then those from test modules changed since
+    the last run; see testhelper.runners.ordering. With last_failed on, or
+    the TESTHELPER_LAST_FAILED environment variable set, only the tests
+    that failed last time run, or every test when none did. With failfast
+    on, or TESTHELPER_FAILFAST set, the run stops at the first failure.
+
+    With profile on, or the TESTHELPER_PROFILE environment variable set to
+    a threshold in seconds, every test is profiled and those slower than
+    profile_threshold are merged into one profile and summed up at the end;
+    see testhelper.runners.profiling.
     
     Returns the number of tests that failed.
     """
@@ -27,28 +99,73 @@ def quieter(test_labels, verbosity=1, interactive=True, extra_tests=[]):
     setup_test_environment()
     
     settings.DEBUG = False    
-    suite = unittest.TestSuite()
-    
-    if test_labels:
-        for label in test_labels:
-            if '.' in label:
-                suite.addTest(build_test(label))
-            else:
-                app = get_app(label)
-                suite.addTest(build_suite(app))
-    else:
-        for app in get_apps():
-            suite.addTest(build_suite(app))
-    
-    for test in extra_tests:
-        suite.addTest(test)
+    suite = build_test_suite(test_labels, extra_tests)
+    history = TimingHistory()
+    shard = shard or os.environ.get('TESTHELPER_SHARD')
+    if shard:
+        suite = shard_suite(suite, shard, shard_timings)
+    if last_failed or os.environ.get('TESTHELPER_LAST_FAILED'):
+        suite = select_failed(suite, history)
+    suite = prioritize(suite, history)
+    failfast = failfast or bool(os.environ.get('TESTHELPER_FAILFAST'))
+    if os.environ.get('TESTHELPER_PROFILE'):
+        profile, profile_threshold = True, float(os.environ['TESTHELPER_PROFILE'])
 
     old_name = settings.DATABASE_NAME
     from django.db import connection
-    connection.creation.create_test_db(db_verbosity, autoclobber=not interactive)
-    result = unittest.TextTestRunner(verbosity=verbosity).run(suite)
+    create_test_db(db_verbosity, autoclobber=not interactive)
+    if profile:
+        from testhelper.runners.profiling import ProfilingTestRunner
+        runner = ProfilingTestRunner(verbosity=verbosity, failfast=failfast, threshold=profile_threshold)
+    else:
+        runner = TimingTestRunner(verbosity=verbosity, failfast=failfast)
+    result = runner.run(suite)
     connection.creation.destroy_test_db(old_name, db_verbosity)
+
+    history.update(runner.timings, result.failed_ids())
+    history.save()
+    if query_log:
+        print_query_summary(timings=runner.timings)
+    if profile:
+        runner.profiles.report(path=runner.profiles.save())
     
     teardown_test_environment()
     
-    return len(result.failures) + len(result.errors)
\ No newline at end of file
+    return len(result.failures) + len(result.errors)
+
+def main(argv=None):
+    """
+    Runs quieter from the command line, with DJANGO_SETTINGS_MODULE set:
+
+    python -m testhelper.runners.quiet [--shard i/n [--shard-timings path]] [--profile [--profile-threshold s]]
+        [--failfast] [--last-failed] [--refresh-fixtures] [--noinput] [app ...]
+
+    Exits with 1 when any test failed.
+    """
+    parser = OptionParser(usage="%prog [options] [appname ...]")
+    parser.add_option('-v', '--verbosity', type='int', default=1)
+    parser.add_option('--noinput', action='store_false', dest='interactive', default=True,
+        help="Don't prompt before destroying an old test database.")
+    parser.add_option('--shard', help="Only run shard i of n, for example 2/4.")
+    parser.add_option('--shard-timings',
+        help="Timing history shared by every node, to balance the shards with.")
+    parser.add_option('--profile', action='store_true', default=False,
+        help="Profile every test and report the slowest tests and hottest functions.")
+    parser.add_option('--profile-threshold', type='float', default=0,
+        help="Only keep the profiles of tests slower than this many seconds.")
+    parser.add_option('--failfast', action='store_true', default=False,
+        help="Stop at the first failing test.")
+    parser.add_option('--last-failed', action='store_true', default=False,
+        help="Only run the tests that failed last time.")
+    parser.add_option('--refresh-fixtures', action='store_true', default=False,
+        help="Run fixture recipes again instead of loading their cached rows.")
+    options, test_labels = parser.parse_args(argv)
+    if options.refresh_fixtures:
+        os.environ['TESTHELPER_REFRESH_FIXTURES'] = '1'
+    failures = quieter(test_labels, options.verbosity, options.interactive, shard=options.shard,
+        profile=options.profile, profile_threshold=options.profile_threshold,
+        failfast=options.failfast, last_failed=options.last_failed, shard_timings=options.shard_timings)
+    return int(bool(failures))
+
+if __name__ == '__main__':
+    sys.exit(main())
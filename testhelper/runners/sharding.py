@@ -0,0 +1,90 @@
+"""
+Splitting a test suite into shards for parallel workers or CI nodes.
+
+Tests of one TestCase class always stay together, so class level fixtures
+run once per shard. Shards are balanced by the timings recorded in a
+TimingHistory, longest class first onto the least loaded shard. Shards
+split across CI nodes are only balanced by a history all nodes share.
+"""
+import heapq
+import unittest
+
+def flatten_suite(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            for t in flatten_suite(test):
+                yield t
+        else:
+            yield test
+
+def group_tests(suite):
+    """
+    Groups the tests in suite by TestCase class, in suite order. Doctests
+    each get a group of their own.
+    """
+    groups, order = {}, []
+    for test in flatten_suite(suite):
+        if isinstance(test, unittest.TestCase) and not hasattr(test, '_dt_test'):
+            key = test.__class__
+        else:
+            key = test
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(test)
+    return [groups[key] for key in order]
+
+def split_suite(suite, count, history=None):
+    """
+    Splits suite into count suites of about the same expected duration,
+    using the longest-processing-time-first rule. Without a history every
+    test is assumed to take as long as any other.
+    """
+    groups = group_tests(suite)
+    if history is None:
+        weights = [len(tests) for tests in groups]
+    else:
+        weights = [history.estimate_group(tests) for tests in groups]
+
+    by_weight = sorted(range(len(groups)), key=lambda i: (-weights[i], i))
+    loads = [(0, shard) for shard in range(count)]
+    assigned = [[] for shard in range(count)]
+    for i in by_weight:
+        load, shard = heapq.heappop(loads)
+        assigned[shard].append(i)
+        heapq.heappush(loads, (load + weights[i], shard))
+
+    shards = []
+    for indexes in assigned:
+        shard = unittest.TestSuite()
+        for i in sorted(indexes):
+            shard.addTests(groups[i])
+        shards.append(shard)
+    return shards
+
+def parse_shard(value):
+    """
+    Parses a shard given as 'i/n', the i-th of n shards counting from 1,
+    into an (i, n) tuple.
+    """
+    try:
+        index, count = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise ValueError("A shard looks like 2/4, not %r." % value)
+    if not 1 <= index <= count:
+        raise ValueError("Shard %s is not one of 1 to %s." % (index, count))
+    return index, count
+
+def select_shard(suite, shard, history=None):
+    """
+    Returns the part of suite belonging to shard, an (i, n) tuple. Every
+    node running a shard has to compute the same split, so the tests are
+    ordered by id first, and history has to be one all nodes share, like a
+    timings file kept in the repository. Without it the split only depends
+    on the test ids.
+    """
+    index, count = shard
+    ordered = unittest.TestSuite()
+    for tests in sorted(group_tests(suite), key=lambda tests: tests[0].id()):
+        ordered.addTests(tests)
+    return split_suite(ordered, count, history)[index - 1]
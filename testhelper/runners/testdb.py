@@ -0,0 +1,141 @@
+"""
+Test databases restored from a template instead of running syncdb.
+
+The first run builds the test database as usual, into a sqlite file kept
+in the cache directory and named after a hash of every installed model's
+SQL, its permissions and the initial_data fixtures. Later runs, and every
+worker of the parallel runner, copy that file instead. A new template is
+built automatically when the hash changes.
+
+Only sqlite3 is supported; other backends get a regular test database.
+Turn it on with settings.TESTHELPER_TEST_DB_TEMPLATE = True.
+"""
+import glob, os, shutil
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.core.management.sql import custom_sql_for_model
+from django.db import connection
+from django.db.backends import BaseDatabaseWrapper
+from django.db.models import get_apps, get_models
+from django.utils.hashcompat import md5_constructor
+
+from testhelper.storage import cache_path
+
+def templates_enabled():
+    return getattr(settings, 'TESTHELPER_TEST_DB_TEMPLATE', False) and settings.DATABASE_ENGINE == 'sqlite3'
+
+def create_test_db(verbosity=1, autoclobber=False):
+    """
+    Drop-in replacement for connection.creation.create_test_db that
+    restores the test database from a template when templates are enabled.
+    Returns the name of the test database.
+    """
+    if not templates_enabled():
+        return connection.creation.create_test_db(verbosity, autoclobber)
+    return restore_template(ensure_template(verbosity), verbosity, autoclobber)
+
+def template_key():
+    "Hash of everything syncdb would create for the installed apps."
+    style = no_style()
+    creation = connection.creation
+    digest = md5_constructor(settings.DATABASE_ENGINE)
+    for model in get_models():
+        statements, references = creation.sql_create_model(model, style, set())
+        statements += creation.sql_indexes_for_model(model, style)
+        statements += creation.sql_for_many_to_many(model, style)
+        statements += custom_sql_for_model(model, style)
+        statements.append(repr(sorted(model._meta.permissions)))
+        for statement in statements:
+            digest.update(statement.encode('utf-8'))
+    for path in sorted(_initial_data_files()):
+        digest.update(open(path, 'rb').read())
+    return digest.hexdigest()
+
+def _initial_data_files():
+    directories = list(settings.FIXTURE_DIRS)
+    for app in get_apps():
+        directories.append(os.path.join(os.path.dirname(app.__file__), 'fixtures'))
+    paths = []
+    for directory in directories:
+        paths.extend(glob.glob(os.path.join(directory, 'initial_data.*')))
+    return paths
+
+def template_path(key=None):
+    return cache_path('testdb', '%s.sqlite3' % (key or template_key()))
+
+def ensure_template(verbosity=1):
+    "Returns the path of the current template, building it if needed."
+    path = template_path()
+    if not os.path.exists(path):
+        build_template(path, verbosity)
+    return path
+
+def build_template(path, verbosity=1):
+    """
+    Creates a test database in the sqlite file at path with syncdb, then
+    removes templates left by older model definitions. Database settings
+    are put back the way they were.
+    """
+    old_database_name = settings.DATABASE_NAME
+    old_test_database_name = settings.TEST_DATABASE_NAME
+    building_path = "%s.%s" % (path, os.getpid())
+    settings.TEST_DATABASE_NAME = building_path
+    try:
+        _close(connection)
+        connection.creation.create_test_db(verbosity, autoclobber=True)
+        connection.close()
+        os.rename(building_path, path)
+    finally:
+        settings.TEST_DATABASE_NAME = old_test_database_name
+        settings.DATABASE_NAME = old_database_name
+        connection.settings_dict['DATABASE_NAME'] = old_database_name
+        if os.path.exists(building_path):
+            os.remove(building_path)
+
+    for stale in glob.glob(os.path.join(os.path.dirname(path), '*.sqlite3')):
+        if stale != path:
+            os.remove(stale)
+
+def restore_template(path, verbosity=1, autoclobber=False):
+    """
+    Creates the test database as a copy of the template at path, the way
+    create_test_db would create it with syncdb.
+    """
+    creation = connection.creation
+    test_database_name = creation._create_test_db(verbosity, autoclobber)
+
+    _close(connection)
+    settings.DATABASE_NAME = test_database_name
+    connection.settings_dict['DATABASE_NAME'] = test_database_name
+    if test_database_name == ':memory:':
+        connection.cursor()
+        copy_database(path, connection.connection)
+    else:
+        shutil.copyfile(path, test_database_name)
+
+    can_rollback = creation._rollback_works()
+    settings.DATABASE_SUPPORTS_TRANSACTIONS = can_rollback
+    connection.settings_dict['DATABASE_SUPPORTS_TRANSACTIONS'] = can_rollback
+    connection.cursor()
+    return test_database_name
+
+def _close(db):
+    "Closes db even when it is an in-memory sqlite database, which close() ignores."
+    BaseDatabaseWrapper.close(db)
+
+def copy_database(path, db):
+    """
+    Copies the tables, rows and indexes of the sqlite file at path into db,
+    an open sqlite3 connection, through an attached database.
+    """
+    cursor = db.cursor()
+    cursor.execute("ATTACH DATABASE ? AS template", [path])
+    cursor.execute("SELECT type, name, sql FROM template.sqlite_master "
+        "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' ORDER BY type = 'table' DESC")
+    for type, name, sql in cursor.fetchall():
+        cursor.execute(sql)
+        if type == 'table':
+            cursor.execute('INSERT INTO main."%s" SELECT * FROM template."%s"' % (name, name))
+    db.commit()
+    cursor.execute("DETACH DATABASE template")
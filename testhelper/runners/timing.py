@@ -0,0 +1,142 @@
+"""
+Per-test and per-class wall times, recorded on every run and kept in a
+history file so that later runs can balance their shards. The history also
+keeps the ids of the tests that failed, so later runs can start with them.
+"""
+import os, sys, time
+import unittest
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from testhelper.storage import cache_path
+
+# Seconds assumed for a test when nothing at all has been recorded yet.
+DEFAULT_ESTIMATE = 0.1
+
+def test_class_name(test):
+    return "%s.%s" % (test.__class__.__module__, test.__class__.__name__)
+
+class TimingTestResult(unittest._TextTestResult):
+    "Appends (test id, class name, seconds) to timings for every test run."
+    def __init__(self, stream, descriptions, verbosity, timings):
+        unittest._TextTestResult.__init__(self, stream, descriptions, verbosity)
+        self.timings = timings
+
+    def startTest(self, test):
+        self._started = time.time()
+        unittest._TextTestResult.startTest(self, test)
+
+    def stopTest(self, test):
+        unittest._TextTestResult.stopTest(self, test)
+        self.timings.append((test.id(), test_class_name(test), time.time() - self._started))
+
+    # Python 2.7's TestResult stops on its own when failfast is set, older
+    # ones need telling.
+    def addError(self, test, err):
+        unittest._TextTestResult.addError(self, test, err)
+        if getattr(self, 'failfast', False):
+            self.stop()
+
+    def addFailure(self, test, err):
+        unittest._TextTestResult.addFailure(self, test, err)
+        if getattr(self, 'failfast', False):
+            self.stop()
+
+    def failed_ids(self):
+        "The ids of the tests that failed or raised an error."
+        return [test.id() for test, tb in self.failures + self.errors]
+
+class TimingTestRunner(unittest.TextTestRunner):
+    """
+    A TextTestRunner collecting the timings of the tests it runs. With
+    failfast on, the run stops at the first failure or error.
+    """
+    def __init__(self, stream=sys.stderr, descriptions=1, verbosity=1, failfast=False):
+        unittest.TextTestRunner.__init__(self, stream, descriptions, verbosity)
+        self.failfast = failfast
+        self.timings = []
+
+    def _makeResult(self):
+        result = TimingTestResult(self.stream, self.descriptions, self.verbosity, self.timings)
+        result.failfast = self.failfast
+        return result
+
+class TimingHistory(object):
+    """
+    Recorded wall times in seconds, by test id and by test class name.
+    Each new timing is averaged with the previous one to smooth out noise.
+    failed lists the ids of the tests that failed when they last ran, and
+    last_run is the time of the last update, or None.
+    """
+    def __init__(self, path=None):
+        self.path = path or cache_path('timings.json')
+        self.tests, self.classes = {}, {}
+        self.failed, self.last_run = [], None
+        self.load()
+
+    def load(self):
+        try:
+            data = json.load(open(self.path))
+        except (IOError, ValueError):
+            return
+        self.tests = data.get('tests', {})
+        self.classes = data.get('classes', {})
+        self.failed = data.get('failed', [])
+        self.last_run = data.get('last_run')
+
+    def save(self):
+        temp_path = "%s.%s" % (self.path, os.getpid())
+        f = open(temp_path, 'w')
+        try:
+            json.dump({'tests': self.tests, 'classes': self.classes,
+                'failed': self.failed, 'last_run': self.last_run}, f)
+        finally:
+            f.close()
+        os.rename(temp_path, self.path)
+
+    def update(self, timings, failed=()):
+        """
+        Merges a list of (test id, class name, seconds) into the history,
+        with failed the ids of the tests that failed among them. Tests that
+        did not run keep their failures.
+        """
+        class_totals = {}
+        for test_id, class_name, seconds in timings:
+            self.tests[test_id] = self._smooth(self.tests.get(test_id), seconds)
+            class_totals[class_name] = class_totals.get(class_name, 0) + seconds
+        for class_name, seconds in class_totals.items():
+            self.classes[class_name] = self._smooth(self.classes.get(class_name), seconds)
+
+        ran = set([test_id for test_id, class_name, seconds in timings])
+        kept = [test_id for test_id in self.failed if test_id not in ran]
+        self.failed = kept + [test_id for test_id in failed if test_id not in kept]
+        self.last_run = time.time()
+
+    def _smooth(self, previous, seconds):
+        if previous is None:
+            return seconds
+        return (previous + seconds) / 2.0
+
+    def default_estimate(self):
+        "The median recorded test time, for tests that have never run."
+        if not self.tests:
+            return DEFAULT_ESTIMATE
+        times = sorted(self.tests.values())
+        return times[len(times) // 2]
+
+    def estimate_group(self, tests):
+        """
+        Expected seconds for a group of tests from one class. Tests with no
+        history of their own get their class's average, or the median.
+        """
+        known = [self.tests[t.id()] for t in tests if t.id() in self.tests]
+        unknown = len(tests) - len(known)
+        if not unknown:
+            return sum(known)
+        class_time = self.classes.get(test_class_name(tests[0]))
+        if class_time is not None:
+            return sum(known) + unknown * class_time / len(tests)
+        return sum(known) + unknown * self.default_estimate()
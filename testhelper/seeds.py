@@ -0,0 +1,35 @@
+"""
+Seeds for the random values DjangoTestCase generates.
+
+Every run has a seed, taken from the TESTHELPER_SEED environment variable
+or picked at random and exported to it, so the parallel runner's workers
+share it. Each test gets its own seed derived from the run seed and its
+id, so a test draws the same values whichever tests ran before it and
+whichever worker runs it. Running a failed test again with the
+TESTHELPER_SEED it reports reproduces its values.
+"""
+import os, random
+
+from django.utils.hashcompat import md5_constructor
+
+def get_run_seed():
+    "The seed of this run, picking and exporting one if none was given."
+    seed = os.environ.get('TESTHELPER_SEED')
+    if not seed:
+        seed = os.environ['TESTHELPER_SEED'] = str(random.SystemRandom().randint(1, 2 ** 31 - 1))
+    return int(seed)
+
+def derive_seed(name, run_seed=None):
+    "A seed for name, usually a test id, derived from the run seed."
+    if run_seed is None:
+        run_seed = get_run_seed()
+    return int(md5_constructor("%s:%s" % (run_seed, name)).hexdigest()[:8], 16)
+
+def get_worker():
+    """
+    (worker, workers): the number of this worker process and how many there
+    are, from the TESTHELPER_WORKER and TESTHELPER_WORKERS environment
+    variables the parallel runner sets. (0, 1) outside of it.
+    """
+    workers = max(1, int(os.environ.get('TESTHELPER_WORKERS', 1)))
+    return int(os.environ.get('TESTHELPER_WORKER', 0)) % workers, workers
@@ -0,0 +1,20 @@
+import os
+
+from django.conf import settings
+
+def get_cache_dir():
+    """
+    Directory for the files testhelper keeps between test runs: timing
+    history, database templates and fixture caches. Set it with
+    settings.TESTHELPER_CACHE_DIR, it defaults to .testhelper in the
+    current directory.
+    """
+    return getattr(settings, 'TESTHELPER_CACHE_DIR', None) or os.path.join(os.getcwd(), '.testhelper')
+
+def cache_path(*names):
+    "Path of a file inside the cache directory, creating the directory if needed."
+    path = os.path.join(get_cache_dir(), *names)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return path
@@ -0,0 +1,57 @@
+"""
+An index of the templates rendered for a test client response, built once
+and kept on the response, so that many template assertions against one
+response cost a single pass over response.template.
+"""
+
+class TemplateIndex(object):
+    """
+    names lists the names of the rendered templates in render order, and
+    positions maps each name to the positions it was rendered at.
+    Templates created from strings have no name and are listed as None.
+    """
+    def __init__(self, templates):
+        self.names = []
+        self.positions = {}
+        for position, template in enumerate(templates):
+            name = getattr(template, 'name', None)
+            self.names.append(name)
+            self.positions.setdefault(name, []).append(position)
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def __len__(self):
+        return len(self.names)
+
+    def count(self, name):
+        "How many times name was rendered."
+        return len(self.positions.get(name, ()))
+
+    def first(self, name):
+        "The position name was first rendered at, or None."
+        positions = self.positions.get(name)
+        if not positions:
+            return None
+        return positions[0]
+
+    def in_order(self, names):
+        "Whether the first renderings of names happened in that order."
+        firsts = [self.first(name) for name in names]
+        return None not in firsts and firsts == sorted(firsts)
+
+def rendered_templates(response):
+    "response.template as a list, which the test client leaves bare for one template."
+    templates = getattr(response, 'template', None)
+    if templates is None:
+        return []
+    if isinstance(templates, (list, tuple)):
+        return templates
+    return [templates]
+
+def get_template_index(response):
+    "The TemplateIndex of response, built on first use."
+    index = getattr(response, '_template_index', None)
+    if index is None:
+        index = response._template_index = TemplateIndex(rendered_templates(response))
+    return index
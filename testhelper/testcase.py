@@ -1,101 +1,624 @@
-from urlparse import urlparse
-import random, datetime, pprint
+from __future__ import with_statement
+import random, datetime, copy, sys
 import unittest2
 
-try:
-    import json
-except ImportError:
-    import simplejson as json
-
+from django.conf import settings
 from django.test import TestCase
-from django.test.client import Client
 from django.db.models.query import QuerySet
-from django.contrib.auth.models import User
 from django.db import models
+from django.db.models.fields import FieldDoesNotExist
+
+from testhelper.bulk import insert_objects, insert_m2m
+from testhelper.capture import ResponseCapture, ResponseCaptureClient
+from testhelper.indexes import RandomIndexAllocator, CounterIndexAllocator
+from testhelper.plans import get_plan, get_graph, compile_values, RelatedFactory
+from testhelper.queries import CaptureQueries, duplicate_queries, log_test_queries
+from testhelper.seeds import get_run_seed, derive_seed, get_worker
+from testhelper.templates import get_template_index
+
+# Password hashes computed with fast_password_hashing on, by raw password.
+_password_hashes = {}
+
+# The admin user shared by every test class with admin_user_scope = 'database'.
+_database_admin_user = None
+
+# The class whose class fixtures are in the database, so that they can be
+# deleted by the next class when the runner doesn't call tearDownClass, as
+# the unittest of Python 2.6 and older doesn't.
+_fixture_class = None
+
+# The first primary key given to objects made by build_object.
+FAKE_PK_START = 10 ** 9
+
+# django.contrib.auth, the fixture cache and the JSON validator are only
+# imported by the methods using them, so that importing this module for a
+# single short test run stays cheap; see benchmark.measure_import.
 
 class DjangoTestCase(TestCase, unittest2.TestCase):
-    object_indexes = []
+    # The IndexAllocator behind create_object_index, and whether a fresh one
+    # is used for every 'test' or one is shared by the whole 'class'.
+    index_allocator_class = RandomIndexAllocator
+    index_allocator_scope = 'test'
+
+    # Where self.admin_user comes from: 'test' creates it in every setUp,
+    # 'class' once per TestCase class and 'database' once per test
+    # database. Shared users are saved outside the per-test transaction, so
+    # changes a test makes to them are rolled back like any other.
+    admin_user_scope = 'test'
+
+    # Record how many queries each test runs, and how long they take, for
+    # the summary printed by the quieter runner. settings.TESTHELPER_LOG_QUERIES
+    # turns it on for every test.
+    log_queries = False
+
+    # Hash each raw password once and reuse the result, instead of hashing
+    # it again every time a test user is created.
+    fast_password_hashing = False
+
+    # How objects for related model classes named in Testing defaults are
+    # made: 'fresh' creates one for every object, 'test' shares one per
+    # test and 'class' one per TestCase class, created before its first
+    # test. relation_policies sets it for a related model, or for a single
+    # relation keyed by (model, field name), and relation_policy for the
+    # rest. Relations through unique fields, like OneToOneFields, are
+    # always 'fresh'.
+    relation_policy = 'fresh'
+    relation_policies = {}
+
+    # Make create_object, create_valid_object and create_objects build
+    # unsaved instances in memory, like build_object, instead of saving them.
+    # A per-test admin user is built the same way.
+    build_mode = False
+
+    # Whether each test gets the objects from setUpClassObjects as fresh
+    # copies of the instances built for the class, or reloaded from the
+    # database.
+    refetch_class_objects = False
+
+    # What self.client keeps of the templates rendered for each response:
+    # 'full' templates and contexts, 'templates' only their names, which is
+    # enough for get_template and the template assertions, or 'none'.
+    # capture_responses changes it for the requests inside a with block.
+    response_capture = 'full'
 
     def setUp(self):
         self.admin_user_password = "admin_password"
-        self.admin_user = User(username="admin_username", email='admin_username@fake.com', is_staff=True, is_active=True, is_superuser=True)
-        self.admin_user.set_password(self.admin_user_password)
-        self.admin_user.save()
-        self.assertValidObject(self.admin_user)
+        if self.__uses_shared_admin_user():
+            self.admin_user = copy.copy(self.__class__._class_fixtures['admin_user'])
+        elif self.build_mode:
+            self.admin_user = self.build_admin_user()
+        else:
+            self.admin_user = self.create_admin_user()
+            self.assertValidObject(self.admin_user)
 
-    def create_object(self, klass, overrides = dict()):
-        if hasattr(klass, 'Testing') and hasattr(klass.Testing, 'defaults'):
-            initial_values = klass.Testing.defaults.copy()
+        if settings.DATABASE_SUPPORTS_TRANSACTIONS:
+            class_objects = self.__class__.__dict__.get('_class_fixtures', {}).get('objects', {})
+            for name, value in class_objects.items():
+                setattr(self, name, self.__copy_class_object(value))
         else:
-            initial_values = {}
+            # Without transactions the database is flushed before every
+            # test, so there is nothing to share.
+            for name, value in self.setUpClassObjects().items():
+                setattr(self, name, value)
 
-        if overrides:
-            initial_values.update(overrides)
+    def setUpClassObjects(self):
+        """
+            Override to build objects used by every test in the class once,
+            with create_object and friends, instead of in every setUp.
+            Returns a dict; each test finds its values as attributes.
+
+            It runs before the first test of the class, outside of the
+            transaction each test is rolled back in, and whatever rows it
+            adds are deleted again after its last test. Tests get shallow
+            copies of the instances, or instances reloaded from the
+            database with refetch_class_objects on, so changes made to
+            them don't carry over to the next test.
+        """
+        return {}
+
+    def run(self, result=None):
+        """
+            Runs the test, then writes the seed that reproduces its random
+            values if it failed.
+        """
+        if result is None:
+            return super(DjangoTestCase, self).run(result)
+        failed = len(result.failures) + len(result.errors)
+        super(DjangoTestCase, self).run(result)
+        if len(result.failures) + len(result.errors) > failed:
+            worker, workers = get_worker()
+            replay = "TESTHELPER_SEED=%s" % get_run_seed()
+            if workers > 1:
+                replay += " TESTHELPER_WORKER=%s TESTHELPER_WORKERS=%s" % (worker, workers)
+            stream = getattr(result, 'stream', None) or sys.stderr
+            stream.write("\n%s failed, replay its random values with %s\n" % (self.id(), replay))
+
+    def _fixture_setup(self):
+        """
+            Runs _class_fixture_setup before the first test of each class,
+            outside of the transaction that wraps every test. The class
+            fixtures of the class before are deleted first if the runner
+            didn't call its tearDownClass.
+        """
+        global _fixture_class
+        cls = self.__class__
+        if _fixture_class is not None and _fixture_class is not cls:
+            _fixture_class._class_fixture_teardown()
+        if '_class_fixtures' not in cls.__dict__:
+            cls._class_fixtures = {}
+            cls._class_objects = []
+            _fixture_class = cls
+            try:
+                self._class_fixture_setup()
+            except:
+                cls._class_fixture_teardown()
+                raise
+        super(DjangoTestCase, self)._fixture_setup()
+        self.client = ResponseCaptureClient(self.response_capture)
+
+        self._start_query_log()
+
+    def _fixture_teardown(self):
+        self._stop_query_log()
+        super(DjangoTestCase, self)._fixture_teardown()
+
+    def _start_query_log(self):
+        if self.log_queries or getattr(settings, 'TESTHELPER_LOG_QUERIES', False):
+            self._logged_queries = CaptureQueries()
+            self._logged_queries.__enter__()
 
-        self.obj_index = self.create_object_index()
-        for key, value in initial_values.items():
-            initial_values[key] = self.__expand_default_value(value)
+    def _stop_query_log(self):
+        "Writes the queries captured since _start_query_log to the query log."
+        logged_queries = self.__dict__.pop('_logged_queries', None)
+        if logged_queries is not None:
+            logged_queries.__exit__(None, None, None)
+            log_test_queries(self.id(), logged_queries)
 
-        o = klass(**initial_values)
+    def _class_fixture_setup(self):
+        """
+            Creates the objects shared by every test in the class. Anything
+            added to _class_objects is deleted again by _class_fixture_teardown.
+        """
+        global _database_admin_user
+        if settings.DATABASE_SUPPORTS_TRANSACTIONS:
+            self.__create_class_related_objects()
+            self.__create_class_objects()
+        if not self.__uses_shared_admin_user():
+            return
 
+        self.admin_user_password = "admin_password"
+        if self.admin_user_scope == 'database':
+            from django.contrib.auth.models import User
+            if _database_admin_user is None or not User.objects.filter(pk=_database_admin_user.pk).count():
+                _database_admin_user = self.create_admin_user()
+            admin_user = _database_admin_user
+        else:
+            admin_user = self.create_admin_user()
+            self._class_objects.append(admin_user)
+        self._class_fixtures['admin_user'] = admin_user
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._class_fixture_teardown()
+        super(DjangoTestCase, cls).tearDownClass()
+
+    @classmethod
+    def _class_fixture_teardown(cls):
+        "Deletes the class fixtures, which a later test of the class would set up again."
+        global _fixture_class
+        if _fixture_class is cls:
+            _fixture_class = None
+        for instance in reversed(cls.__dict__.get('_class_objects', [])):
+            if isinstance(instance, QuerySet):
+                instance.delete()
+            else:
+                instance.__class__._default_manager.filter(pk=instance.pk).delete()
+        if '_class_fixtures' in cls.__dict__:
+            del cls._class_fixtures
+            del cls._class_objects
+
+    def __create_class_related_objects(self):
+        """
+            Creates the related objects shared by the whole class, each after
+            the objects it needs.
+        """
+        shared_models = []
+        for key, policy in self.relation_policies.items():
+            if policy == 'class':
+                if isinstance(key, tuple):
+                    key = dict(get_plan(key[0]).relations).get(key[1])
+                if key is not None:
+                    shared_models.append(key)
+
+        self._class_fixtures['related_objects'] = {}
+        self._creating_class_fixtures = True
+        try:
+            for model in shared_models:
+                for related in get_graph(model).order:
+                    if related in shared_models:
+                        self.create_related_object(None, None, related, 'class')
+        finally:
+            del self._creating_class_fixtures
+
+    def __create_class_objects(self):
+        """
+            Runs setUpClassObjects, remembering the rows it adds to every
+            table with an auto-incremented primary key for _class_fixture_teardown.
+        """
+        if self.__class__.setUpClassObjects == DjangoTestCase.setUpClassObjects:
+            return
+        from testhelper.fixturecache import tracked_models, max_pk
+        tracked = tracked_models()
+        before = [max_pk(m) for m in tracked]
+        self._creating_class_fixtures = True
+        try:
+            self._class_fixtures['objects'] = self.setUpClassObjects()
+        finally:
+            del self._creating_class_fixtures
+            for model, last_pk in zip(tracked, before):
+                if max_pk(model) > last_pk:
+                    self._class_objects.append(model._default_manager.filter(pk__gt=last_pk))
+
+    def load_cached_objects(self, name, recipe, force=False):
+        """
+            Returns the dict of objects recipe(self) creates and returns,
+            running the recipe only when its rows aren't cached on disk yet,
+            or when force is on. Otherwise the cached rows are inserted in
+            bulk and the objects fetched back. See testhelper.fixturecache.
+        """
+        from testhelper.fixturecache import FixtureCache, recipe_key, needs_refresh, record, load
+        cache = FixtureCache()
+        key = recipe_key(name, recipe, repr(sorted(self.relation_policies.items())))
+        if not (force or needs_refresh(key)):
+            data = cache.get(name, key)
+            if data is not None:
+                return load(data)
+        objects, data = record(lambda: recipe(self))
+        cache.put(name, key, data)
+        return objects
+
+    def __copy_class_object(self, value):
+        if isinstance(value, (list, tuple)):
+            return value.__class__([self.__copy_class_object(v) for v in value])
+        if not isinstance(value, models.Model):
+            return value
+        if self.refetch_class_objects:
+            return value.__class__._default_manager.get(pk=value.pk)
+        return copy.copy(value)
+
+    def __uses_shared_admin_user(self):
+        "Shared users only survive between tests when the database can roll back."
+        return self.admin_user_scope != 'test' and settings.DATABASE_SUPPORTS_TRANSACTIONS
+
+    def create_admin_user(self):
+        """
+            Saves and returns the superuser used as self.admin_user. A user
+            left behind by an earlier class with the same username is reused.
+        """
+        from django.contrib.auth.models import User
         try:
-            post_save_defaults = klass.Testing.post_save_defaults.copy()
+            user = User.objects.get(username="admin_username")
+        except User.DoesNotExist:
+            user = User(username="admin_username")
+        self.__set_admin_fields(user)
+        user.save()
+        return user
+
+    def build_admin_user(self):
+        """
+            Returns the superuser used as self.admin_user with build_mode
+            on, unsaved and with a fake primary key, like build_object's.
+        """
+        from django.contrib.auth.models import User
+        user = User(username="admin_username", pk=self.create_fake_pk())
+        self.__set_admin_fields(user)
+        return user
+
+    def __set_admin_fields(self, user):
+        user.email = 'admin_username@fake.com'
+        user.is_staff = user.is_active = user.is_superuser = True
+        self.set_password(user, self.admin_user_password)
+
+    def set_password(self, user, raw_password):
+        """
+            Sets the password of user, reusing an earlier hash of the same
+            raw password when fast_password_hashing is on.
+        """
+        if not self.fast_password_hashing:
+            user.set_password(raw_password)
+        elif raw_password in _password_hashes:
+            user.password = _password_hashes[raw_password]
+        else:
+            user.set_password(raw_password)
+            _password_hashes[raw_password] = user.password
+
+    def create_object(self, klass, overrides = dict()):
+        if self.__building():
+            return self.build_object(klass, overrides)
+        plan = get_graph(klass).plans[klass]
+        self.obj_index = index = self.create_object_index()
+        o = klass(**plan.expand_defaults(self, index, overrides))
+
+        if plan.post_save_defaults is not None:
             o.save()
-            for key, value in post_save_defaults.items():
-                value = self.__expand_default_value(value)
+            for key, value in plan.expand_post_save_defaults(self, index):
                 try:
                     setattr(o, key, value)
                 except TypeError:
                     setattr(o, key, [value, ])
             o.save()
-        except AttributeError:
-            pass #Doesn't have any post_save defaults
 
         return o
 
-    def __expand_default_value(self, value):
-        "Inserts random numbers, ints, or instantiates classes."
-        obj_index = self.obj_index
-        if hasattr(value, "startswith") and "#{ran}" in value:
-            value = value.replace("#{ran}", str(obj_index))
-        elif hasattr(value, "startswith") and "#{ran_i}" in value:
-            value = int(value.replace("#{ran_i}", str(obj_index)))
-        elif hasattr(value, "startswith") and "#{now}" in value:
-            value = datetime.datetime.now()
+    def create_objects(self, klass, n, overrides=dict(), batch_size=None):
+        """
+            Creates and saves n instances of klass, the same way create_object
+            would, but with one multi-row INSERT per batch instead of a save()
+            per object.
+
+            Model classes named in Testing.defaults or Testing.post_save_defaults
+            are created in batches as well, one per object unless their
+            relation policy shares them, and many-to-many relations are
+            added with grouped inserts into the join table.
+
+            The number of queries used is stored in self.last_batch_query_count.
+            Signals are not sent for the inserted objects.
+        """
+        if self.__building():
+            self.last_batch_query_count = 0
+            return [self.build_object(klass, overrides) for i in xrange(n)]
+        with CaptureQueries() as queries:
+            objects = self.__create_objects(klass, n, overrides, batch_size)
+        self.last_batch_query_count = len(queries)
+        return objects
+
+    def __create_objects(self, klass, n, overrides, batch_size):
+        plan = get_graph(klass).plans[klass]
+        defaults = dict(plan.defaults)
+        if overrides:
+            defaults.update(compile_values(overrides, klass))
+        m2m_fields = dict([(f.name, f) for f in klass._meta.many_to_many])
+        post_save_defaults, m2m_defaults = [], []
+        for key, expander in plan.post_save_defaults or []:
+            if key in m2m_fields:
+                m2m_defaults.append((key, expander))
+            else:
+                post_save_defaults.append((key, expander))
+
+        # Related model classes become one batch of fresh objects per field,
+        # everything else is expanded object by object.
+        rows = [({}, {}) for i in xrange(n)]
+        for values_index, expanders in enumerate((defaults.items(), post_save_defaults)):
+            for key, expander in expanders:
+                if isinstance(expander, RelatedFactory):
+                    related = self.__create_related_objects(klass, key, expander.model, n, batch_size)
+                    for row, related_object in zip(rows, related):
+                        row[values_index][key] = related_object
+        for values, post_save_values in rows:
+            self.obj_index = index = self.create_object_index()
+            for values_index, expanders in enumerate((defaults.items(), post_save_defaults)):
+                for key, expander in expanders:
+                    if not isinstance(expander, RelatedFactory):
+                        (values, post_save_values)[values_index][key] = expander.expand(self, index)
+
+        objects = []
+        for values, post_save_values in rows:
+            o = klass(**values)
+            for key, value in post_save_values.items():
+                setattr(o, key, value)
+            objects.append(o)
+        insert_objects(klass, objects, batch_size)
+
+        for key, expander in m2m_defaults:
+            if isinstance(expander, RelatedFactory):
+                related = self.__create_related_objects(klass, key, expander.model, n, batch_size)
+                pairs = [(o.pk, r.pk) for o, r in zip(objects, related)]
+            else:
+                pairs = []
+                for o in objects:
+                    self.obj_index = index = self.create_object_index()
+                    value = expander.expand(self, index)
+                    if not isinstance(value, (list, tuple)):
+                        value = [value]
+                    pairs.extend([(o.pk, r.pk) for r in value])
+            insert_m2m(m2m_fields[key], pairs, batch_size)
+
+        return objects
+
+    def __create_related_objects(self, owner, key, model, n, batch_size):
+        "The related objects for n objects of owner, in one batch unless they are shared."
+        if self.get_relation_policy(owner, key, model) == 'fresh':
+            return self.__create_objects(model, n, {}, batch_size)
+        return [self.create_related_object(owner, key, model)] * n
+
+    def get_relation_policy(self, owner, key, model):
+        "The relation policy for the field key of owner, a relation to model."
+        if owner is not None:
+            try:
+                field = owner._meta.get_field(key)
+            except FieldDoesNotExist:
+                field = None
+            if getattr(field, 'unique', False):
+                return 'fresh'
+        policy = self.relation_policies.get((owner, key)) or self.relation_policies.get(model) or self.relation_policy
+        if policy == 'class' and not settings.DATABASE_SUPPORTS_TRANSACTIONS:
+            policy = 'test'
+        if policy == 'test' and '_creating_class_fixtures' in self.__dict__:
+            policy = 'fresh'
+        return policy
+
+    def create_related_object(self, owner, key, model, policy=None):
+        """
+            Returns the object for the field key of owner, a relation to
+            model named in its Testing defaults, following the relation policy.
+        """
+        policy = policy or self.get_relation_policy(owner, key, model)
+        if self.__building():
+            # Built objects aren't in the database, so they are shared by the test at most.
+            if policy == 'fresh':
+                return self.build_object(model)
+            built = self.__dict__.setdefault('_built_related_objects', {})
+            if model not in built:
+                built[model] = self.build_object(model)
+            return built[model]
+        if policy == 'class' and model in self._class_fixtures.get('related_objects', {}):
+            return self._class_fixtures['related_objects'][model]
+        if policy == 'class' and '_creating_class_fixtures' not in self.__dict__:
+            # Objects created inside a test are rolled back with it.
+            policy = 'test'
+        if policy == 'test' and model in self.__dict__.get('_related_objects', {}):
+            return self._related_objects[model]
+
+        related = self.create_valid_object(model)
+        if '_creating_class_fixtures' in self.__dict__:
+            self._class_objects.append(related)
+        if policy == 'class':
+            self._class_fixtures['related_objects'][model] = related
+        elif policy == 'test':
+            self.__dict__.setdefault('_related_objects', {})[model] = related
+        return related
+
+    def build_object(self, klass, overrides=dict()):
+        """
+            Returns an instance of klass populated like create_object would,
+            without a single query. It gets a fake primary key, and related
+            objects are built the same way and attached through Django's
+            related object caches, so a.category or archive.article need
+            no query either. Many-to-many relations can't be cached that
+            way; their objects are kept in a list by field name in the
+            instance's built_many_to_many dict.
+        """
+        plan = get_graph(klass).plans[klass]
+        nested = '_building_objects' in self.__dict__
+        self._building_objects = True
+        try:
+            self.obj_index = index = self.create_object_index()
+            o = klass(**plan.expand_defaults(self, index, overrides))
+            if o.pk is None:
+                o.pk = self.create_fake_pk()
+            if plan.post_save_defaults is not None:
+                for key, value in plan.expand_post_save_defaults(self, index):
+                    self.__set_built_value(o, key, value)
+        finally:
+            if not nested:
+                del self._building_objects
+        return o
+
+    def __set_built_value(self, o, key, value):
         try:
-            #Maybe you passed in a class
-            value = self.create_valid_object(value)
-        except TypeError:
-            pass
-            
-        return value
+            field = o._meta.get_field(key)
+        except FieldDoesNotExist:
+            field = None
+        if isinstance(field, models.ManyToManyField):
+            if not isinstance(value, (list, tuple)):
+                value = [value]
+            o.__dict__.setdefault('built_many_to_many', {})[key] = list(value)
+            return
+        setattr(o, key, value)
+        if isinstance(field, models.OneToOneField) and value is not None:
+            setattr(value, '_%s_cache' % field.related.get_accessor_name(), o)
+
+    def create_fake_pk(self):
+        """
+            Returns a primary key for a built object, from a range well
+            above the ones the test database hands out.
+        """
+        allocator = self.__dict__.get('_fake_pk_allocator')
+        if allocator is None:
+            allocator = self._fake_pk_allocator = CounterIndexAllocator(FAKE_PK_START)
+        return allocator.allocate()
+
+    def __building(self):
+        return self.build_mode or '_building_objects' in self.__dict__
 
     def create_valid_object(self, klass):
         o = self.create_object(klass)
+        if o.pk is not None and self.__building():
+            return o
         o.save()
         
         self.assert_(o.id, "We should have a valid saved object")
         return o
 
     def create_object_index(self):
-        return self.create_random_unique_integer()
+        index = self.get_index_allocator().allocate()
+        if '_creating_class_fixtures' in self.__dict__:
+            self._class_fixtures.setdefault('indexes', []).append(index)
+        return index
+
+    def get_index_allocator(self):
+        """
+            Returns the allocator for this test, or for the whole class when
+            index_allocator_scope is 'class'. Class fixtures always get one
+            for the class, and the indexes it handed out are marked used in
+            the allocator of every test, since their rows outlive the test.
+        """
+        if self.index_allocator_scope == 'class':
+            owner = self.__class__
+        elif '_creating_class_fixtures' in self.__dict__:
+            fixtures = self._class_fixtures
+            if 'index_allocator' not in fixtures:
+                fixtures['index_allocator'] = self.create_index_allocator('class')
+            return fixtures['index_allocator']
+        else:
+            owner = self
+        allocator = owner.__dict__.get('_index_allocator')
+        if allocator is None:
+            allocator = self.create_index_allocator()
+            if owner is self:
+                for index in self.__class__.__dict__.get('_class_fixtures', {}).get('indexes', ()):
+                    allocator.mark_used(index)
+            setattr(owner, '_index_allocator', allocator)
+        return allocator
+
+    def create_index_allocator(self, scope=None):
+        """
+            Random allocators draw from their own stream, seeded for this
+            test, or for the class when scope, index_allocator_scope by
+            default, is 'class'.
+        """
+        scope = scope or self.index_allocator_scope
+        if issubclass(self.index_allocator_class, RandomIndexAllocator):
+            if scope == 'class':
+                name = "%s.%s" % (self.__class__.__module__, self.__class__.__name__)
+            else:
+                name = self.id()
+            return self.index_allocator_class(random=random.Random(derive_seed(name)))
+        return self.index_allocator_class()
+
+    def _get_random(self):
+        """
+            A random.Random for this test, seeded from the run seed and the
+            test id so that its values can be replayed with TESTHELPER_SEED.
+        """
+        if '_random' not in self.__dict__:
+            self._random = random.Random(derive_seed(self.id()))
+        return self._random
+    random = property(_get_random)
 
     def create_random_unique_integer(self, max_value=99999):
         """
             Returns a random, but unique integer.
             Uniqeness is per instance of DjangoTestCase, as 'used' integers
-            are stored in an instance's object_indexes array.
+            are stored in a set kept for each max_value.
         """
-        random_int = self.create_random_integer(max_value)
-        while random_int in self.object_indexes:
-            #We've got a duplicate here, try again
-            random_int = self.create_random_integer(max_value=max_value+1)
-
-        self.object_indexes.append(random_int)
-        return random_int
+        allocators = self.__dict__.setdefault('_unique_integer_allocators', {})
+        if max_value not in allocators:
+            allocators[max_value] = RandomIndexAllocator(max_value, random=self.random)
+        return allocators[max_value].allocate()
 
     def create_random_integer(self, max_value=99999):
-        return random.randint(1, max_value)
+        return self.random.randint(1, max_value)
+
+    def capture_responses(self, capture):
+        """
+            Sets what self.client keeps on the responses to the requests made
+            inside the with block: 'full', 'templates' or 'none'.
+
+            with self.capture_responses('none'):
+                self.client.get('/big-page/')
+        """
+        return ResponseCapture(self.client, capture)
 
     def get_template(self, response, index=0):
         """
@@ -111,12 +634,85 @@ class DjangoTestCase(TestCase, unittest2.TestCase):
         except TypeError:
             return response.template
 
+    def get_template_index(self, response):
+        """
+            Returns the TemplateIndex of the templates rendered for the
+            response: their names in render order, and the positions each
+            name was rendered at. It is built once and kept on the response.
+        """
+        return get_template_index(response)
+
+    def assertTemplateUsed(self, response, template_name, count=None):
+        """
+            Asserts that the template was used to render the response, exactly
+            count times when count is given.
+        """
+        index = get_template_index(response)
+        if not len(index):
+            self.fail('No templates used to render the response')
+        self.assert_(template_name in index,
+            (u"Template '%s' was not a template used to render the response."
+             u" Actual template(s) used: %s") % (template_name, u', '.join(map(unicode, index.names))))
+        if count is not None:
+            self.assertEqual(count, index.count(template_name),
+                u"Template '%s' was rendered %s times, %s expected" % (template_name, index.count(template_name), count))
+
+    def assertTemplateNotUsed(self, response, template_name):
+        self.failIf(template_name in get_template_index(response),
+            u"Template '%s' was used unexpectedly in rendering the response" % template_name)
+
+    def assertTemplateOrder(self, response, template_names):
+        """
+            Asserts that the templates were all used, and first rendered in
+            the order given.
+        """
+        index = get_template_index(response)
+        for template_name in template_names:
+            self.assertTemplateUsed(response, template_name)
+        self.assert_(index.in_order(template_names),
+            u"Templates %s were not rendered in that order: %s" % (u', '.join(template_names), u', '.join(map(unicode, index.names))))
+
     def assert404(self, response):
         self.assertEqual(response.status_code, 404, "We should have a 404 response: %s != %s" % (response.status_code, 404))
 
     def assert200(self, response):
         self.assertEqual(response.status_code, 200, "We should have a valid response: %s != %s" % (response.status_code, 200))
 
+    def assertNumQueries(self, num):
+        """
+            Context manager failing unless exactly num queries run inside it.
+
+            with self.assertNumQueries(1):
+                list(Article.objects.all())
+        """
+        def check(queries):
+            self.assertEqual(len(queries), num, "%s queries executed, %s expected%s" % (len(queries), num, _list_queries(queries)))
+        return _AssertQueries(check)
+
+    def assertMaxQueries(self, num):
+        "Context manager failing when more than num queries run inside it."
+        def check(queries):
+            self.assert_(len(queries) <= num, "%s queries executed, at most %s expected%s" % (len(queries), num, _list_queries(queries)))
+        return _AssertQueries(check)
+
+    def assertQueryTime(self, ms):
+        "Context manager failing when the queries run inside it take more than ms milliseconds."
+        def check(queries):
+            spent = queries.total_time * 1000
+            self.assert_(spent <= ms, "Queries took %.0fms, at most %sms expected%s" % (spent, ms, _list_queries(queries)))
+        return _AssertQueries(check)
+
+    def assertNoDuplicateQueries(self, max_repeats=1):
+        """
+            Context manager failing when any query runs more than max_repeats
+            times inside it, ignoring its parameters. Catches N+1 queries.
+        """
+        def check(queries):
+            duplicates = duplicate_queries(queries, max_repeats)
+            msg = "".join(["\n%s times: %s" % (count, sql) for sql, count in duplicates])
+            self.assertFalse(duplicates, "Queries repeated more than %s times:%s" % (max_repeats, msg))
+        return _AssertQueries(check)
+
     def assertValidObject(self, instance):
         instance.save()
         self.assert_(instance.id, "Valid objects should be save()-able and have an id.")
@@ -124,18 +720,39 @@ class DjangoTestCase(TestCase, unittest2.TestCase):
     def assertContentType(self, response, content_type):
         self.assertIn(content_type, response["Content-Type"])
 
-    def assertValidJsonResponse(self, response):
+    def assertValidJsonResponse(self, response, **shape):
         self.assert200(response)
-        self.assertValidJson(response.content)
+        self.assertValidJson(response, **shape)
 
-    def assertValidJson(self, content_string):
-        print dir(json)
+    def assertValidJson(self, content, **shape):
+        """
+        Checks that content, a string or an iterable of chunks such as a
+        response, is valid JSON without loading it. The shape arguments,
+        required_keys, length, min_length and max_length, check the top
+        level of the document; see testhelper.jsonstream.
+        """
+        from testhelper.jsonstream import validate_json
         try:
-            json_feed = json.loads(content_string)
-        except json.JSONDecodeError, e:
+            validate_json(content, **shape)
+        except ValueError, e:
             raise self.failureException, unicode(e)
 
     def assertCloseDatetimes(self, expected, actual, seconds=5):
         delta = abs(expected - actual)
         msg = "Expected datetime: %s is not within %s seconds of the actual datetime: %s" % (expected, seconds, actual)
-        self.assert_(delta.seconds <= seconds, msg)
\ No newline at end of file
+        self.assert_(delta.seconds <= seconds, msg)
+
+class _AssertQueries(CaptureQueries):
+    "Captures queries and passes them to check unless the block raised."
+    def __init__(self, check):
+        super(_AssertQueries, self).__init__()
+        self.check = check
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super(_AssertQueries, self).__exit__(exc_type, exc_value, traceback)
+        if exc_type is None:
+            self.check(self)
+        return False
+
+def _list_queries(queries):
+    return "".join(["\n%s: %s" % (i + 1, q['sql']) for i, q in enumerate(queries)])
@@ -0,0 +1,59 @@
+"""
+Benchmarks for the testingapp views and for importing testhelper. Run them with:
+
+DJANGO_SETTINGS_MODULE=testhelper.testingapp.settings \
+    python -m testhelper.testingapp.benchmarks [results.json]
+"""
+import sys
+
+from django.core.urlresolvers import reverse
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from testhelper.benchmark import ViewBenchmark, measure_import, measure_response_memory, write_results
+from testhelper.capture import CAPTURE_POLICIES, ResponseCaptureClient
+
+# Modules imported by every short test run, timed by main.
+STARTUP_MODULES = ['testhelper.testcase', 'testhelper.runners.quiet']
+
+def get_benchmarks(iterations=1000):
+    return [
+        ViewBenchmark('multi_template', iterations=iterations),
+        ViewBenchmark('single_template', iterations=iterations),
+        ViewBenchmark('json_valid', name='json', iterations=iterations),
+    ]
+
+def measure_capture(views=('multi_template', 'single_template', 'json_valid')):
+    "measure_response_memory for each view under each capture policy, as a list."
+    results = []
+    setup_test_environment()
+    try:
+        for view in views:
+            for capture in CAPTURE_POLICIES:
+                result = measure_response_memory(ResponseCaptureClient(capture), reverse(view))
+                result.update(name='%s capture=%s' % (view, capture), capture=capture)
+                results.append(result)
+    finally:
+        teardown_test_environment()
+    return results
+
+def main(argv=None):
+    argv = argv or sys.argv[1:]
+    results = [benchmark.run() for benchmark in get_benchmarks()]
+    for result in results:
+        latency = result['latency_ms']
+        print "%-16s p50 %.3fms  p99 %.3fms  %8.0f req/s" % (result['name'], latency['p50'],
+            latency['p99'], result['requests_per_second'])
+    for result in measure_capture():
+        size = result['bytes_per_response']
+        print "%-32s %6.0f objects/response %s" % (result['name'], result['objects_per_response'],
+            size is not None and "%8.0f bytes/response" % size or '')
+        results.append(result)
+    for module in STARTUP_MODULES:
+        result = measure_import(module)
+        print "%-32s %.3fs  %d modules" % (result['name'], result['seconds'], len(result['modules']))
+        results.append(result)
+    if argv:
+        write_results(results, argv[0])
+
+if __name__ == '__main__':
+    main()
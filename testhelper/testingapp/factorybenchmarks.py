@@ -0,0 +1,147 @@
+"""
+Benchmarks for DjangoTestCase's factory methods on the testingapp models,
+run against a fresh test database:
+
+DJANGO_SETTINGS_MODULE=testhelper.testingapp.settings \
+    python -m testhelper.testingapp.factorybenchmarks [--baseline old.json]
+        [--threshold 0.2] [--counts 1,10,100] [results.json]
+
+Articles are created with 0 to 2 related model classes in their
+overrides, a Category through a ForeignKey and an Archive through a
+OneToOneField, and once with a Tag added through the ManyToManyField.
+Exits with 1 when a result is worse than in the baseline by more than the
+threshold.
+"""
+import sys, unittest
+from optparse import OptionParser
+
+from django.conf import settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from testhelper.benchmark import FactoryBenchmark, compare_results, read_results, write_results
+from testhelper.runners.testdb import create_test_db
+from testhelper.testcase import DjangoTestCase
+from testhelper.testingapp.models import Archive, Article, Category, Tag
+
+COUNTS = (1, 10, 100)
+
+# Overrides turning each related model of Article into a fresh object.
+RELATIONS = [('category', Category), ('archive', Archive)]
+
+def article_overrides(relations):
+    return dict(RELATIONS[:relations])
+
+def create_articles(overrides):
+    def recipe(testcase, n):
+        articles = []
+        for i in xrange(n):
+            article = testcase.create_object(Article, overrides)
+            article.save()
+            articles.append(article)
+        return articles
+    return recipe
+
+def create_valid_objects(model):
+    def recipe(testcase, n):
+        return [testcase.create_valid_object(model) for i in xrange(n)]
+    return recipe
+
+def build_articles(overrides):
+    def recipe(testcase, n):
+        return [testcase.build_object(Article, overrides) for i in xrange(n)]
+    return recipe
+
+def create_tagged_articles(testcase, n):
+    articles = []
+    for i in xrange(n):
+        article = testcase.create_valid_object(Article)
+        article.tags.add(testcase.create_valid_object(Tag))
+        articles.append(article)
+    return articles
+
+def create_articles_in_bulk(overrides, batch_size):
+    def recipe(testcase, n):
+        return testcase.create_objects(Article, n, overrides, batch_size)
+    return recipe
+
+def get_benchmarks(counts=COUNTS):
+    benchmarks = [
+        FactoryBenchmark('create_valid_object Tag', create_valid_objects(Tag), counts),
+        FactoryBenchmark('create_valid_object Article', create_valid_objects(Article), counts),
+        FactoryBenchmark('create_valid_object Article with a tag', create_tagged_articles, counts),
+    ]
+    for relations in range(len(RELATIONS) + 1):
+        overrides = article_overrides(relations)
+        benchmarks.extend([
+            FactoryBenchmark('build_object Article, %s relations' % relations, build_articles(overrides), counts),
+            FactoryBenchmark('create_object Article, %s relations' % relations, create_articles(overrides), counts),
+        ])
+    for batch_size in (10, None):
+        benchmarks.append(FactoryBenchmark('create_objects Article, 2 relations, batch_size %s' % batch_size,
+            create_articles_in_bulk(article_overrides(2), batch_size), counts))
+    return benchmarks
+
+class FactoryBenchmarks(DjangoTestCase):
+    """
+    Runs every benchmark inside one test, so that the transaction the test
+    case wraps it in rolls back the objects when it is called.
+    """
+    counts = COUNTS
+
+    def runTest(self):
+        self.results = []
+        for benchmark in get_benchmarks(self.counts):
+            self.results.extend(benchmark.run(self))
+
+def run_benchmark_case(counts=COUNTS):
+    """
+    Runs the benchmarks as a FactoryBenchmarks test and returns their
+    results. Calling the case, rather than its run method, sets up its
+    transaction and rolls it back afterwards.
+    """
+    case = FactoryBenchmarks()
+    case.counts = counts
+    result = unittest.TestResult()
+    case(result)
+    failures = result.errors + result.failures
+    if failures:
+        raise RuntimeError("The factory benchmarks failed:\n%s" % failures[0][1])
+    return case.results
+
+def run_benchmarks(counts=COUNTS):
+    "Runs the benchmarks against a new test database and returns their results."
+    setup_test_environment()
+    old_name = settings.DATABASE_NAME
+    from django.db import connection
+    create_test_db(0, autoclobber=True)
+    try:
+        return run_benchmark_case(counts)
+    finally:
+        connection.creation.destroy_test_db(old_name, 0)
+        teardown_test_environment()
+
+def main(argv=None):
+    parser = OptionParser(usage="%prog [options] [results.json]")
+    parser.add_option('--baseline', help="Results to compare with, written by an earlier run.")
+    parser.add_option('--threshold', type='float', default=0.2,
+        help="Fraction by which a result may be worse than the baseline.")
+    parser.add_option('--counts', default=','.join([str(n) for n in COUNTS]),
+        help="Numbers of objects to create, separated by commas.")
+    options, args = parser.parse_args(argv)
+
+    results = run_benchmarks(tuple([int(n) for n in options.counts.split(',')]))
+    for result in results:
+        memory = result['memory_per_object_bytes']
+        print "%-62s %9.0f obj/s %6.2f q/obj %s" % (result['name'], result['objects_per_second'],
+            result['queries_per_object'], memory is not None and "%8dB/obj" % memory or '')
+    if args:
+        write_results(results, args[0])
+    if options.baseline:
+        regressions = compare_results(results, read_results(options.baseline), options.threshold)
+        for regression in regressions:
+            print "Regression: %s" % regression
+        return int(bool(regressions))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
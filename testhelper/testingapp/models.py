@@ -12,6 +12,12 @@ class Tag(models.Model):
 class Archive(models.Model):
     pass
 
+class Badge(models.Model):
+    code = models.IntegerField(unique=True)
+
+    class Testing:
+        defaults = {'code': '#{ran_i}'}
+
 class Article(models.Model):
     boolean = models.BooleanField()
     name = models.CharField(blank=True, max_length=255)
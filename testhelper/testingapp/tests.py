@@ -1,8 +1,24 @@
 from __future__ import with_statement
-import datetime
+import datetime, os, random, shutil, sqlite3, tempfile, threading, time
+from StringIO import StringIO
+import unittest2
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.http import HttpResponse
 
 from testhelper.testcase import DjangoTestCase
-from testhelper.testingapp import models
+from testhelper.requestfactory import SlimRequestFactory
+from testhelper import benchmark, bulk, capture, concurrency, fixturecache, indexes, jsonstream, plans, queries, seeds, testcase
+from testhelper.runners import ordering, parallel, profiling, quiet, sharding, testdb, timing
+from testhelper.testingapp import benchmarks, factorybenchmarks, models, views
+
+def make_temp_dir(testcase):
+    "Makes a temporary directory, removed again when testcase is done."
+    path = tempfile.mkdtemp()
+    testcase.addCleanup(shutil.rmtree, path, True)
+    return path
 
 class TestHelperTests(DjangoTestCase):
     def setUp (self):
@@ -150,6 +166,32 @@ class TestHelperTests(DjangoTestCase):
         
         r = self.client.get('/single-template/')
         self.assertEqual('testingapp/single-template.html', self.get_template(r).name)
+
+    def test_template_assertions(self):
+        """
+            Template assertions should all work off one index kept on the
+            response.
+        """
+        r = self.client.get('/multi-template/')
+        index = self.get_template_index(r)
+        self.assert_(index is self.get_template_index(r))
+        self.assertEqual(['testingapp/multi-template.html', 'testingapp/base.html'], index.names)
+
+        self.assertTemplateUsed(r, 'testingapp/base.html')
+        self.assertTemplateUsed(r, 'testingapp/base.html', count=1)
+        self.assertTemplateNotUsed(r, 'testingapp/single-template.html')
+        self.assertTemplateOrder(r, ['testingapp/multi-template.html', 'testingapp/base.html'])
+        with self.assertRaises(AssertionError):
+            self.assertTemplateUsed(r, 'testingapp/base.html', count=2)
+        with self.assertRaises(AssertionError):
+            self.assertTemplateNotUsed(r, 'testingapp/base.html')
+        with self.assertRaises(AssertionError):
+            self.assertTemplateOrder(r, ['testingapp/base.html', 'testingapp/multi-template.html'])
+
+        r = self.client.get('/single-template/')
+        self.assertTemplateUsed(r, 'testingapp/single-template.html', count=1)
+        with self.assertRaises(AssertionError):
+            self.assertTemplateUsed(r, 'testingapp/base.html')
     
     def test_unittest2_inheritance(self):
         """
@@ -223,4 +265,1144 @@ class TestHelperTests(DjangoTestCase):
         with self.assertRaises(AssertionError):
             self.assertValidJson(r.content)
         with self.assertRaises(AssertionError):
-            self.assertValidJsonResponse(r)
\ No newline at end of file
+            self.assertValidJsonResponse(r)
+
+    def test_assertValidJson_shape(self):
+        r = self.client.get('/json/valid/')
+        self.assertValidJsonResponse(r, required_keys=['name', 'foo'], length=2)
+        with self.assertRaises(AssertionError):
+            self.assertValidJsonResponse(r, required_keys=['bar'])
+        with self.assertRaises(AssertionError):
+            self.assertValidJson(r.content, min_length=3)
+
+    def test_create_objects(self):
+        """
+            create_objects should save n objects, with their default
+            relations, using a number of queries that doesn't grow with n.
+        """
+        tags = self.create_objects(models.Tag, 20)
+        self.assertEqual(20, len(set([t.pk for t in tags])))
+        self.assertEqual(20, models.Tag.objects.filter(pk__in=[t.pk for t in tags]).count())
+        self.assertEqual(1, self.last_batch_query_count)
+
+        models.Article.Testing.defaults = { 'name': 'Article #{ran}' }
+        models.Article.Testing.post_save_defaults = {
+            'category': models.Category,
+            'tags': models.Tag,
+            'archive': models.Archive,
+        }
+        articles = self.create_objects(models.Article, 10)
+        few_queries = self.last_batch_query_count
+        articles += self.create_objects(models.Article, 40)
+        self.assertEqual(few_queries, self.last_batch_query_count)
+
+        for a in articles:
+            saved = models.Article.objects.get(pk=a.pk)
+            self.assertEqual(a.name, saved.name)
+            self.assertEqual(a.category_id, saved.category.pk)
+            self.assertEqual(1, saved.tags.count())
+            self.assert_(saved.archive)
+        self.assertEqual(50, len(set([a.category_id for a in articles])))
+
+    def test_create_objects_unknown_backend(self):
+        """
+            Backends whose inserted ids aren't known should get one INSERT
+            per object, and the right primary keys.
+        """
+        id_rows = bulk.INSERT_ID_ROW
+        bulk.INSERT_ID_ROW = {}
+        try:
+            tags = self.create_objects(models.Tag, 3, {'name': 'Tag #{ran}'})
+        finally:
+            bulk.INSERT_ID_ROW = id_rows
+        self.assertEqual(3, self.last_batch_query_count)
+        for tag in tags:
+            self.assertEqual(tag.name, models.Tag.objects.get(pk=tag.pk).name)
+
+class SharedAdminUserTests(DjangoTestCase):
+    admin_user_scope = 'class'
+    fast_password_hashing = True
+    admin_user_pks = []
+
+    def test_admin_user_is_shared(self):
+        """
+            With admin_user_scope = 'class' every test should get the same
+            saved admin user, and changes made by a test should be rolled back.
+        """
+        self.admin_user_pks.append(self.admin_user.pk)
+        self.assert_(self.admin_user.check_password(self.admin_user_password))
+        self.assertEqual(1, len(set(self.admin_user_pks)))
+        self.assertEqual('admin_username@fake.com', User.objects.get(pk=self.admin_user.pk).email)
+
+        self.admin_user.email = 'changed@fake.com'
+        self.admin_user.save()
+
+    def test_admin_user_is_shared_again(self):
+        self.test_admin_user_is_shared()
+
+    def test_fast_password_hashing(self):
+        """
+            With fast_password_hashing each raw password is hashed only once.
+        """
+        user = User(username='fast')
+        self.set_password(user, 'secret')
+        other = User(username='faster')
+        self.set_password(other, 'secret')
+        self.assertEqual(user.password, other.password)
+        self.assert_(other.check_password('secret'))
+
+class IndexAllocatorTests(DjangoTestCase):
+    def test_random_allocator(self):
+        """
+            The random allocator should hand out every value up to max_value
+            once, refuse to go past it, and forget its values when reset.
+        """
+        allocator = indexes.RandomIndexAllocator(max_value=10, worker=0, workers=1)
+        values = [allocator.allocate() for i in xrange(10)]
+        self.assertEqual(range(1, 11), sorted(values))
+        with self.assertRaises(ValueError):
+            allocator.allocate()
+        allocator.reset()
+        self.assertEqual(0, len(allocator.used))
+        self.assert_(allocator.allocate() <= 10)
+
+    def test_random_allocator_workers(self):
+        "Workers should split the values up to max_value between them."
+        values = []
+        for worker in range(2):
+            allocator = indexes.RandomIndexAllocator(max_value=7, random=random.Random(1), worker=worker, workers=2)
+            values.append(sorted([allocator.allocate() for i in xrange(allocator.slots)]))
+            with self.assertRaises(ValueError):
+                allocator.allocate()
+        self.assertEqual([[1, 3, 5, 7], [2, 4, 6]], values)
+        allocator.reset()
+        allocator.mark_used(4)
+        self.assertEqual([2, 6], sorted([allocator.allocate() for i in xrange(2)]))
+
+    def test_counter_allocator(self):
+        allocator = indexes.CounterIndexAllocator(start=5)
+        self.assertEqual([5, 6, 7], [allocator.allocate() for i in xrange(3)])
+        allocator.reset()
+        self.assertEqual(5, allocator.allocate())
+
+    def test_partitioned_allocator(self):
+        """
+            Workers should draw from disjoint blocks and refuse to overflow
+            into the next one.
+        """
+        first = indexes.PartitionedIndexAllocator(worker=0, partition_size=3)
+        second = indexes.PartitionedIndexAllocator(worker=1, partition_size=3)
+        self.assertEqual([1, 2, 3], [first.allocate() for i in xrange(3)])
+        self.assertEqual([4, 5, 6], [second.allocate() for i in xrange(3)])
+        with self.assertRaises(ValueError):
+            first.allocate()
+
+    def test_index_allocator_scope(self):
+        """
+            Test scoped allocators belong to one test, class scoped ones are
+            shared by every test in the class.
+        """
+        self.index_allocator_class = indexes.CounterIndexAllocator
+        self.assertEqual(1, self.create_object_index())
+        self.assert_(self.get_index_allocator() is not IndexAllocatorTests('test_counter_allocator').get_index_allocator())
+
+        class ClassScoped(DjangoTestCase):
+            index_allocator_class = indexes.CounterIndexAllocator
+            index_allocator_scope = 'class'
+            def runTest(self):
+                pass
+        self.assertEqual(1, ClassScoped().create_object_index())
+        self.assertEqual(2, ClassScoped().create_object_index())
+
+class SeedTests(DjangoTestCase):
+    def test_random_is_seeded_by_test(self):
+        """
+            Each test should draw from its own stream, derived from the run
+            seed and its id.
+        """
+        expected = random.Random(seeds.derive_seed(self.id())).random()
+        self.assertEqual(expected, self.random.random())
+        self.assertEqual(seeds.derive_seed('a', 1), seeds.derive_seed('a', 1))
+        self.assertNotEqual(seeds.derive_seed('a', 1), seeds.derive_seed('b', 1))
+        self.assertNotEqual(seeds.derive_seed('a', 1), seeds.derive_seed('a', 2))
+
+    def test_workers_get_disjoint_values(self):
+        values = []
+        for worker in range(3):
+            allocator = indexes.RandomIndexAllocator(150, random.Random(1), worker=worker, workers=3)
+            values.append(set([allocator.allocate() for i in range(50)]))
+            self.assertEqual(50, len(values[-1]))
+            self.assert_(max(values[-1]) <= 150)
+            self.assertEqual(set([worker]), set([(v - 1) % 3 for v in values[-1]]))
+        self.assertFalse(values[0] & values[1] or values[1] & values[2])
+
+    def test_seed_is_reported_on_failure(self):
+        class Failing(DjangoTestCase):
+            def test_failure(self):
+                self.fail()
+        result = unittest2.TestResult()
+        result.stream = StringIO()
+        Failing('test_failure').run(result)
+        self.assertEqual(1, len(result.failures))
+        self.assertIn("TESTHELPER_SEED=%s" % seeds.get_run_seed(), result.stream.getvalue())
+
+class DefaultsPlanTests(DjangoTestCase):
+    def test_compile_value(self):
+        """
+            Each kind of default should compile to its own expander.
+        """
+        self.assert_(isinstance(plans.compile_value('Pilot #{ran}'), plans.IndexSubstitution))
+        self.assert_(isinstance(plans.compile_value('#{ran_i}'), plans.IntegerIndex))
+        self.assert_(isinstance(plans.compile_value('#{now}'), plans.Timestamp))
+        self.assert_(isinstance(plans.compile_value(models.Category), plans.RelatedFactory))
+        self.assert_(isinstance(plans.compile_value(5), plans.Literal))
+        self.assertEqual('Pilot 12 of 12', plans.compile_value('Pilot #{ran} of #{ran}').expand(self, 12))
+        self.assertEqual(712, plans.compile_value('7#{ran_i}').expand(self, 12))
+
+    def test_plan_is_cached_until_testing_changes(self):
+        """
+            get_plan should hand back the same plan until the model's Testing
+            class or its defaults change.
+        """
+        class Testing:
+            defaults = {'name': 'Tag #{ran}'}
+        original = getattr(models.Tag, 'Testing', None)
+        models.Tag.Testing = Testing
+        try:
+            plan = plans.get_plan(models.Tag)
+            self.assert_(plan is plans.get_plan(models.Tag))
+
+            Testing.defaults['name'] = 'Renamed'
+            self.assert_(plan is not plans.get_plan(models.Tag))
+            self.assertEqual('Renamed', self.create_object(models.Tag).name)
+
+            Testing.post_save_defaults = {}
+            self.assertEqual([], plans.get_plan(models.Tag).post_save_defaults)
+        finally:
+            models.Tag.Testing = original
+
+    def test_relation_graph(self):
+        """
+            get_graph should order related models before the models needing
+            them, and refuse defaults that would create each other forever.
+        """
+        class TagTesting:
+            defaults = {'name': 'Tag #{ran}'}
+            post_save_defaults = {'category': models.Category}
+        class CategoryTesting:
+            post_save_defaults = {'archive': models.Archive}
+        originals = [getattr(m, 'Testing', None) for m in (models.Tag, models.Category)]
+        models.Tag.Testing, models.Category.Testing = TagTesting, CategoryTesting
+        try:
+            graph = plans.get_graph(models.Tag)
+            self.assertEqual([models.Archive, models.Category, models.Tag], graph.order)
+            self.assert_(graph is plans.get_graph(models.Tag))
+
+            CategoryTesting.post_save_defaults = {'tag': models.Tag}
+            self.assertRaises(plans.CyclicDefaults, plans.get_graph, models.Tag)
+            self.assertRaises(plans.CyclicDefaults, self.create_object, models.Category)
+        finally:
+            models.Tag.Testing, models.Category.Testing = originals
+
+class RelationPolicyTests(DjangoTestCase):
+    relation_policies = {
+        models.Category: 'class',
+        (models.Article, 'tags'): 'test',
+    }
+    category_pks = []
+
+    # The class fixtures use the Testing defaults too, so they are swapped
+    # in before them.
+    def _fixture_setup(self):
+        class Testing:
+            defaults = {'name': 'Article #{ran}'}
+            post_save_defaults = {
+                'category': models.Category,
+                'tags': models.Tag,
+                'archive': models.Archive,
+            }
+        self.original_testing = models.Article.Testing
+        models.Article.Testing = Testing
+        try:
+            super(RelationPolicyTests, self)._fixture_setup()
+        except:
+            models.Article.Testing = self.original_testing
+            raise
+
+    def _fixture_teardown(self):
+        try:
+            super(RelationPolicyTests, self)._fixture_teardown()
+        finally:
+            models.Article.Testing = self.original_testing
+
+    def test_relation_policies(self):
+        """
+            Categories should be shared by the class, tags by the test, and
+            archives, behind a OneToOneField, never shared.
+        """
+        articles = [self.create_object(models.Article) for i in range(3)]
+        articles += self.create_objects(models.Article, 3)
+        self.assertEqual(1, len(set([a.category_id for a in articles])))
+        self.assertEqual(1, len(set([a.tags.get().pk for a in articles])))
+        self.assertEqual(6, len(set([a.archive_id for a in articles])))
+
+        self.category_pks.append(articles[0].category_id)
+        self.assertEqual(1, len(set(self.category_pks)))
+        self.assert_(models.Category.objects.filter(pk=articles[0].category_id).count())
+
+    def test_relation_policies_again(self):
+        self.test_relation_policies()
+
+class BuildObjectTests(DjangoTestCase):
+    relation_policies = {models.Category: 'test'}
+
+    def setUp(self):
+        class Testing:
+            defaults = {'name': 'Article #{ran}', 'image': ''}
+            post_save_defaults = {
+                'category': models.Category,
+                'tags': models.Tag,
+                'archive': models.Archive,
+            }
+        self.original_testing = models.Article.Testing
+        models.Article.Testing = Testing
+        super(BuildObjectTests, self).setUp()
+
+    def tearDown(self):
+        models.Article.Testing = self.original_testing
+        super(BuildObjectTests, self).tearDown()
+
+    def test_build_object(self):
+        """
+            build_object should populate an object and its relations without
+            running any queries.
+        """
+        with self.assertNumQueries(0):
+            a = self.build_object(models.Article)
+            b = self.build_object(models.Article, {'name': 'Built'})
+            self.assertEqual(a.category, b.category)
+            self.assert_(a.archive.article is a)
+        self.assert_(a.pk >= testcase.FAKE_PK_START)
+        self.assertNotEqual(a.pk, b.pk)
+        self.assertEqual(a.category.pk, a.category_id)
+        self.assertNotEqual(a.archive, b.archive)
+        self.assertEqual('Built', b.name)
+        self.assert_(isinstance(a.built_many_to_many['tags'][0], models.Tag))
+        self.assertEqual(0, models.Article.objects.count())
+
+class BuildModeTests(BuildObjectTests):
+    build_mode = True
+
+    def test_build_mode(self):
+        """
+            With build_mode on the create_ methods should build objects
+            instead of saving them.
+        """
+        with self.assertNumQueries(0):
+            a = self.create_valid_object(models.Article)
+            articles = self.create_objects(models.Article, 5)
+        self.assert_(a.pk >= testcase.FAKE_PK_START)
+        self.assertEqual(5, len(set([o.pk for o in articles])))
+        self.assertEqual(0, models.Article.objects.count())
+
+class BuildModeRunTests(unittest2.TestCase):
+    def test_build_mode_case_runs_no_queries(self):
+        "A test case with build_mode on shouldn't touch the database from setup to teardown."
+        class Built(DjangoTestCase):
+            build_mode = True
+            def runTest(self):
+                self.create_objects(models.Tag, 2)
+        case = Built()
+        result = unittest2.TestResult()
+        with queries.CaptureQueries() as captured:
+            case(result)
+        self.assertEqual([], result.errors + result.failures)
+        self.assertEqual([], [q['sql'] for q in captured.queries])
+        self.assert_(case.admin_user.pk >= testcase.FAKE_PK_START)
+
+recipe_runs = []
+
+def catalog_recipe(testcase):
+    recipe_runs.append(testcase)
+    category = testcase.create_valid_object(models.Category)
+    articles = [testcase.create_object(models.Article, {'category': category, 'image': ''}) for i in range(3)]
+    for article in articles:
+        article.save()
+        article.tags.add(testcase.create_valid_object(models.Tag))
+    return {'category': category, 'articles': articles, 'count': 3}
+
+class FixtureCacheTests(DjangoTestCase):
+    def setUp(self):
+        self.old_cache_dir = getattr(settings, 'TESTHELPER_CACHE_DIR', None)
+        settings.TESTHELPER_CACHE_DIR = make_temp_dir(self)
+        del recipe_runs[:]
+        super(FixtureCacheTests, self).setUp()
+
+    def tearDown(self):
+        settings.TESTHELPER_CACHE_DIR = self.old_cache_dir
+        super(FixtureCacheTests, self).tearDown()
+
+    def test_load_cached_objects(self):
+        """
+            The recipe should only run once, later calls should insert its
+            rows again, after the ones already there.
+        """
+        created = self.load_cached_objects('catalog', catalog_recipe)
+        loaded = self.load_cached_objects('catalog', catalog_recipe)
+        self.assertEqual(1, len(recipe_runs))
+
+        self.assertEqual(3, loaded['count'])
+        self.assertNotEqual(created['category'].pk, loaded['category'].pk)
+        self.assertEqual(2, models.Category.objects.count())
+        self.assertEqual([a.name for a in created['articles']], [a.name for a in loaded['articles']])
+        for article in loaded['articles']:
+            self.assertEqual(loaded['category'], article.category)
+            self.assertEqual(1, article.tags.count())
+            self.assertNotEqual(created['articles'][0].tags.get(), article.tags.get())
+
+        self.load_cached_objects('catalog', catalog_recipe, force=True)
+        self.assertEqual(2, len(recipe_runs))
+
+    def test_eviction(self):
+        cache = fixturecache.FixtureCache(max_bytes=1024 * 1024, max_age=60)
+        for name in ('old', 'big', 'new'):
+            cache.put(name, 'key', {'rows': [name * 100]})
+        now = time.time()
+        os.utime(cache.path('old', 'key'), (now - 120, now - 120))
+        os.utime(cache.path('big', 'key'), (now - 30, now - 30))
+        cache.max_bytes = os.path.getsize(cache.path('new', 'key'))
+        cache.evict(now)
+        self.assertEqual(None, cache.get('old', 'key'))
+        self.assertEqual(None, cache.get('big', 'key'))
+        self.assertEqual({'rows': ['new' * 100]}, cache.get('new', 'key'))
+
+    def test_key_follows_testing_defaults(self):
+        key = fixturecache.recipe_key('catalog', catalog_recipe)
+        self.assertEqual(key, fixturecache.recipe_key('catalog', catalog_recipe))
+        original_defaults = models.Tag.Testing.defaults
+        models.Tag.Testing.defaults = {'name': 'Tag #{ran}'}
+        try:
+            self.assertNotEqual(key, fixturecache.recipe_key('catalog', catalog_recipe))
+        finally:
+            models.Tag.Testing.defaults = original_defaults
+        self.assertEqual(key, fixturecache.recipe_key('catalog', catalog_recipe))
+
+class ClassObjectsTests(DjangoTestCase):
+    builds = []
+
+    def setUpClassObjects(self):
+        self.builds.append(self.__class__)
+        category = self.create_valid_object(models.Category)
+        category.name = 'Shared category'
+        category.save()
+        articles = [self.create_object(models.Article, {'category': category, 'image': ''}) for i in range(3)]
+        for article in articles:
+            article.save()
+        return {'category': category, 'articles': articles}
+
+    def test_class_objects(self):
+        """
+            setUpClassObjects should run once per class, and changes a test
+            makes to its objects should not reach the next test.
+        """
+        self.assertEqual(1, self.builds.count(self.__class__))
+        self.assertEqual('Shared category', self.category.name)
+        self.assertEqual(3, len(self.articles))
+        self.assertEqual(3, self.category.articles.count())
+
+        self.category.name = 'Changed'
+        self.category.save()
+        self.articles[0].category = None
+        self.articles[0].save()
+
+    def test_class_objects_again(self):
+        self.test_class_objects()
+
+class RefetchedClassObjectsTests(ClassObjectsTests):
+    refetch_class_objects = True
+
+class ClassFixtureIndexTests(DjangoTestCase):
+    def setUpClassObjects(self):
+        return {'badges': [self.create_valid_object(models.Badge) for i in range(5)]}
+
+    def test_indexes_are_not_reissued(self):
+        "Objects made by a test shouldn't get the indexes of the class objects."
+        self.create_objects(models.Badge, 100)
+        for i in range(100):
+            self.create_valid_object(models.Badge)
+        self.assertEqual(205, models.Badge.objects.count())
+
+    def test_indexes_are_not_reissued_again(self):
+        self.test_indexes_are_not_reissued()
+
+class CountedClassFixtureIndexTests(ClassFixtureIndexTests):
+    index_allocator_class = indexes.CounterIndexAllocator
+
+class WithoutClassFixturesTests(unittest2.TestCase):
+    def test_class_objects_without_tear_down_class(self):
+        """
+            When the runner doesn't call tearDownClass, the class objects
+            should be deleted before the next class sets up its own.
+        """
+        class First(ClassObjectsTests):
+            pass
+        class Second(RelationPolicyTests):
+            category_pks = []
+        class Testing:
+            defaults = {'name': 'Article #{ran}'}
+        original_testing = models.Article.Testing
+        models.Article.Testing = Testing
+        try:
+            result = unittest2.TestResult()
+            for test in [First('test_class_objects'), First('test_class_objects_again'),
+                    Second('test_relation_policies'), Second('test_relation_policies_again')]:
+                test(result)
+            self.assertEqual([], result.errors + result.failures)
+            self.assertEqual(0, models.Article.objects.count())
+            self.assertEqual([Second.category_pks[0]], [c.pk for c in models.Category.objects.all()])
+        finally:
+            Second.tearDownClass()
+            models.Article.Testing = original_testing
+        self.assertEqual(0, models.Category.objects.count())
+
+class ShardingTests(DjangoTestCase):
+    def setUp(self):
+        self.temp_dir = make_temp_dir(self)
+        super(ShardingTests, self).setUp()
+
+    def suite(self, classes=(TestHelperTests, IndexAllocatorTests, DefaultsPlanTests)):
+        loader = unittest2.TestLoader()
+        suite = unittest2.TestSuite()
+        for klass in classes:
+            suite.addTests(loader.loadTestsFromTestCase(klass))
+        return suite
+
+    def test_split_suite(self):
+        """
+            split_suite should spread test classes across shards without
+            splitting any class or losing any test.
+        """
+        suite = self.suite()
+        shards = sharding.split_suite(suite, 2)
+        self.assertEqual(2, len(shards))
+        self.assertEqual(suite.countTestCases(), sum([s.countTestCases() for s in shards]))
+        for shard in shards:
+            classes = set([t.__class__ for t in sharding.flatten_suite(shard)])
+            for other in shards:
+                if other is not shard:
+                    self.assertFalse(classes & set([t.__class__ for t in sharding.flatten_suite(other)]))
+
+    def test_split_suite_by_history(self):
+        """
+            With a history, the longest classes should be spread out first so
+            the shards end up with about the same total time.
+        """
+        suite = self.suite()
+        history = timing.TimingHistory(os.path.join(self.temp_dir, 'timings.json'))
+        history.update([(t.id(), timing.test_class_name(t), 1.0) for t in sharding.flatten_suite(suite)
+            if isinstance(t, TestHelperTests)])
+        history.save()
+        history = timing.TimingHistory(history.path)
+
+        first, second = sharding.split_suite(suite, 2, history)
+        self.assertEqual([TestHelperTests], list(set([t.__class__ for t in sharding.flatten_suite(first)])))
+        self.assertEqual(suite.countTestCases(), first.countTestCases() + second.countTestCases())
+
+    def test_shards_across_nodes(self):
+        """
+            Nodes with histories of their own, and tests discovered in another
+            order, should still split the suite the same way, running every
+            test exactly once.
+        """
+        classes = [TestHelperTests, IndexAllocatorTests, DefaultsPlanTests, ShardingTests]
+        shared = timing.TimingHistory(os.path.join(self.temp_dir, 'timings.json'))
+        shared.update([('%s.test' % c.__name__, timing.test_class_name(c('run')), 1.0) for c in classes])
+        shared.save()
+
+        old_cache_dir = getattr(settings, 'TESTHELPER_CACHE_DIR', None)
+        try:
+            for run, shard_timings in enumerate((None, shared.path)):
+                ran = []
+                for node in range(3):
+                    settings.TESTHELPER_CACHE_DIR = os.path.join(self.temp_dir, 'run%s-node%s' % (run, node))
+                    suite = self.suite(classes[node:] + classes[:node])
+                    local = timing.TimingHistory()
+                    local.update([(t.id(), timing.test_class_name(t), random.random() * 10)
+                        for t in sharding.flatten_suite(suite)])
+                    local.save()
+                    shard = quiet.shard_suite(suite, '%s/3' % (node + 1), shard_timings)
+                    ran.extend([t.id() for t in sharding.flatten_suite(shard)])
+                self.assertEqual(sorted([t.id() for t in sharding.flatten_suite(suite)]), sorted(ran))
+        finally:
+            settings.TESTHELPER_CACHE_DIR = old_cache_dir
+
+    def test_parse_shard(self):
+        self.assertEqual((2, 4), sharding.parse_shard('2/4'))
+        for bad in ('0/4', '5/4', 'two'):
+            with self.assertRaises(ValueError):
+                sharding.parse_shard(bad)
+
+class ParallelTests(unittest2.TestCase):
+    def test_run_shards(self):
+        "Each shard should run in its own worker, and a worker that dies should fail its shard."
+        class Worker(unittest2.TestCase):
+            def test_pass(self):
+                pass
+            def test_fail(self):
+                self.fail('Boom')
+            def test_exit(self):
+                os._exit(3)
+        def shard(*names):
+            return unittest2.TestSuite([Worker(name) for name in names])
+
+        stream = StringIO()
+        collected = parallel.run_shards([shard('test_pass', 'test_fail'), shard('test_pass')], verbosity=0)
+        self.assertEqual(1, parallel.report(collected, 0, stream))
+        self.assertIn("Boom", stream.getvalue())
+        self.assertIn("Ran 3 tests in 2 workers, 1 failed.", stream.getvalue())
+
+        stream = StringIO()
+        collected = parallel.run_shards([shard('test_pass'), shard('test_exit', 'test_pass')], verbosity=0)
+        self.assertEqual(1, parallel.report(collected, 0, stream))
+        self.assertIn("Worker 1 exited with code 3", stream.getvalue())
+        self.assertIn(Worker('test_exit').id(), stream.getvalue())
+
+class OrderingTests(DjangoTestCase):
+    def setUp(self):
+        self.temp_dir = make_temp_dir(self)
+        super(OrderingTests, self).setUp()
+
+    def suite(self):
+        loader = unittest2.TestLoader()
+        suite = unittest2.TestSuite()
+        for klass in (TestHelperTests, IndexAllocatorTests, DefaultsPlanTests):
+            suite.addTests(loader.loadTestsFromTestCase(klass))
+        return suite
+
+    def test_history_failures(self):
+        """
+            Failures should be remembered until the test passes again, even
+            across runs that don't include it.
+        """
+        history = timing.TimingHistory(os.path.join(self.temp_dir, 'timings.json'))
+        history.update([('a', 'A', 0.1), ('b', 'B', 0.1)], ['a', 'b'])
+        history.update([('a', 'A', 0.1)], [])
+        history.save()
+        history = timing.TimingHistory(history.path)
+        self.assertEqual(['b'], history.failed)
+        self.assert_(history.last_run)
+
+    def test_prioritize(self):
+        """
+            Classes with a failed test should run first, with the failed
+            tests at their head, then classes from modified modules.
+        """
+        history = timing.TimingHistory(os.path.join(self.temp_dir, 'timings.json'))
+        suite = self.suite()
+        tests = list(sharding.flatten_suite(suite))
+        failed = [t for t in tests if isinstance(t, IndexAllocatorTests)][-1]
+        history.failed = [failed.id()]
+
+        ordered = list(sharding.flatten_suite(ordering.prioritize(suite, history)))
+        self.assertEqual(len(tests), len(ordered))
+        self.assertEqual(failed.id(), ordered[0].id())
+        classes = [t.__class__ for t in ordered]
+        self.assertEqual(IndexAllocatorTests, classes[classes.count(IndexAllocatorTests) - 1])
+        self.assertEqual([t.id() for t in tests if not isinstance(t, IndexAllocatorTests)],
+            [t.id() for t in ordered if not isinstance(t, IndexAllocatorTests)])
+
+        unchanged = unittest2.FunctionTestCase(lambda: None)
+        mtime = os.path.getmtime(ordering.test_file(tests[0]))
+        history.failed = []
+        history.last_run = mtime - 1
+        ordered = list(sharding.flatten_suite(ordering.prioritize(unittest2.TestSuite([unchanged] + tests), history)))
+        self.assertEqual(unchanged, ordered[-1])
+        history.last_run = mtime + 1
+        ordered = list(sharding.flatten_suite(ordering.prioritize(unittest2.TestSuite([unchanged] + tests), history)))
+        self.assertEqual(unchanged, ordered[0])
+
+    def test_select_failed(self):
+        history = timing.TimingHistory(os.path.join(self.temp_dir, 'timings.json'))
+        suite = self.suite()
+        self.assertEqual(suite, ordering.select_failed(suite, history))
+        failed = list(sharding.flatten_suite(suite))[1]
+        history.failed = [failed.id(), 'gone.Tests.test_removed']
+        self.assertEqual([failed.id()], [t.id() for t in ordering.select_failed(suite, history)])
+
+    def test_failfast(self):
+        class Failing(unittest2.TestCase):
+            def test_a(self):
+                self.fail()
+            def test_b(self):
+                pass
+        suite = unittest2.TestSuite([Failing('test_a'), Failing('test_b')])
+        result = timing.TimingTestRunner(stream=StringIO(), failfast=True).run(suite)
+        self.assertEqual(1, result.testsRun)
+        self.assertEqual([Failing('test_a').id()], result.failed_ids())
+
+class ProfilingTests(DjangoTestCase):
+    def setUp(self):
+        self.temp_dir = make_temp_dir(self)
+        super(ProfilingTests, self).setUp()
+
+    def test_profiling_runner(self):
+        """
+            Every test above the threshold should be profiled, merged and
+            reported.
+        """
+        class Profiled(unittest2.TestCase):
+            def test_fast(self):
+                pass
+            def test_slow(self):
+                time.sleep(0.1)
+        def suite():
+            return unittest2.TestSuite([Profiled('test_fast'), Profiled('test_slow')])
+        runner = profiling.ProfilingTestRunner(stream=StringIO(), threshold=0)
+        runner.run(suite())
+        self.assertEqual(2, len(runner.profiles.tests))
+
+        # Far enough from both tests' timings for a loaded machine.
+        runner = profiling.ProfilingTestRunner(stream=StringIO(), threshold=0.05)
+        runner.run(suite())
+        self.assertEqual([Profiled('test_slow').id()], [t[0] for t in runner.profiles.tests])
+
+        path = runner.profiles.save(os.path.join(self.temp_dir, 'profile.pstats'))
+        self.assert_(os.path.exists(path))
+        report = StringIO()
+        runner.profiles.report(report, path)
+        self.assertIn('test_slow', report.getvalue())
+        self.assertIn('Hottest functions', report.getvalue())
+
+class TestDatabaseTemplateTests(DjangoTestCase):
+    def setUp(self):
+        self.temp_dir = make_temp_dir(self)
+        super(TestDatabaseTemplateTests, self).setUp()
+
+    def test_template_key(self):
+        """
+            The template key should only depend on the model definitions.
+        """
+        self.assertEqual(testdb.template_key(), testdb.template_key())
+        self.assertEqual(32, len(testdb.template_key()))
+
+    def test_copy_database(self):
+        """
+            copy_database should bring tables, rows and indexes across.
+        """
+        path = os.path.join(self.temp_dir, 'template.sqlite3')
+        template = sqlite3.connect(path)
+        template.execute("CREATE TABLE thing (id integer NOT NULL PRIMARY KEY, name varchar(10))")
+        template.execute("CREATE INDEX thing_name ON thing (name)")
+        template.execute("INSERT INTO thing (name) VALUES ('kif')")
+        template.commit()
+        template.close()
+
+        db = sqlite3.connect(':memory:')
+        testdb.copy_database(path, db)
+        self.assertEqual([(1, u'kif')], db.execute("SELECT id, name FROM thing").fetchall())
+        self.assertEqual([(u'thing_name',)], db.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall())
+
+class QueryAssertionTests(DjangoTestCase):
+    log_queries = True
+
+    def test_assertNumQueries(self):
+        with self.assertNumQueries(1):
+            models.Tag.objects.count()
+        with self.assertRaises(AssertionError):
+            with self.assertNumQueries(2):
+                models.Tag.objects.count()
+
+    def test_assertMaxQueries(self):
+        with self.assertMaxQueries(2):
+            models.Tag.objects.count()
+        with self.assertRaises(AssertionError):
+            with self.assertMaxQueries(1):
+                models.Tag.objects.count()
+                models.Tag.objects.count()
+
+    def test_assertQueryTime(self):
+        with self.assertQueryTime(10000):
+            models.Tag.objects.count()
+        with self.assertRaises(AssertionError):
+            with self.assertQueryTime(-1):
+                models.Tag.objects.count()
+
+    def test_assertNoDuplicateQueries(self):
+        """
+            Queries differing only in their parameters should count as
+            duplicates.
+        """
+        tags = [self.create_object(models.Tag, {'name': 'Tag %s' % i}) for i in range(3)]
+        for tag in tags:
+            tag.save()
+        with self.assertNoDuplicateQueries():
+            list(models.Tag.objects.filter(pk__in=[t.pk for t in tags]))
+        with self.assertRaises(AssertionError):
+            with self.assertNoDuplicateQueries():
+                for tag in tags:
+                    models.Tag.objects.get(pk=tag.pk)
+        # Django logs string parameters without quotes, so only the SQL
+        # template shows these are the same query.
+        names = ['Fry', 'Leela', 'Bender']
+        for name in names:
+            self.create_object(models.Tag, {'name': name}).save()
+        with self.assertRaises(AssertionError):
+            with self.assertNoDuplicateQueries():
+                for name in names:
+                    models.Tag.objects.get(name=name)
+        with queries.CaptureQueries() as captured:
+            models.Tag.objects.get(name='Fry')
+        self.assertEqual(('Fry',), tuple(captured[0]['params']))
+        self.assertEqual(queries.normalize_sql("SELECT * FROM t WHERE a = 'x''s' AND b IN (1, 2)"),
+            "SELECT * FROM t WHERE a = ? AND b IN (...)")
+
+    def test_queries_through_client_are_captured(self):
+        """
+            Requests reset connection.queries; captures should survive that.
+        """
+        with self.assertNumQueries(1):
+            models.Tag.objects.count()
+            self.client.get('/single-template/')
+
+    def test_log_queries(self):
+        """
+            A test with log_queries on should log the queries it ran once it
+            is over.
+        """
+        class Logged(DjangoTestCase):
+            log_queries = True
+        test = Logged('run')
+        test._start_query_log()
+        models.Tag.objects.count()
+        models.Tag.objects.count()
+        test._stop_query_log()
+        self.assertEqual(2, queries.query_log.pop(test.id())[0])
+
+class CaptureQueriesTests(DjangoTestCase):
+    def test_capture_leaves_no_queries_behind(self):
+        """
+            With DEBUG off, the queries recorded for a capture shouldn't pile
+            up in connection.queries once it is over.
+        """
+        before = len(connection.queries)
+        with queries.CaptureQueries() as outer:
+            with queries.CaptureQueries() as inner:
+                models.Tag.objects.count()
+            models.Tag.objects.count()
+            self.client.get('/single-template/')
+        self.assertEqual(1, len(inner))
+        self.assertEqual(2, len(outer))
+        self.assertEqual(before, len(connection.queries))
+
+        self.create_objects(models.Tag, 3)
+        self.assertEqual(before, len(connection.queries))
+
+class ResponseCaptureTests(DjangoTestCase):
+    response_capture = 'templates'
+
+    def test_template_names(self):
+        """
+            Capturing template names only should still serve get_template
+            and the template assertions, without keeping any context.
+        """
+        r = self.client.get('/multi-template/')
+        self.assertEqual(None, r.context)
+        self.assert_(isinstance(r.template[0], capture.RenderedTemplate))
+        self.assertEqual('testingapp/base.html', self.get_template(r, 1).name)
+        self.assertTemplateOrder(r, ['testingapp/multi-template.html', 'testingapp/base.html'])
+
+        r = self.client.get('/single-template/')
+        self.assertEqual('testingapp/single-template.html', self.get_template(r).name)
+
+    def test_capture_responses(self):
+        with self.capture_responses('none'):
+            r = self.client.get('/multi-template/')
+        self.assertEqual(None, r.template)
+        self.assertEqual(None, r.context)
+        with self.capture_responses('full'):
+            r = self.client.get('/multi-template/')
+        self.assertEqual('testingapp/base.html', r.template[1].name)
+        self.assertEqual(2, len(r.context))
+        self.assertEqual('templates', self.client.capture)
+
+        with self.capture_responses('contexts'):
+            self.assertRaises(ValueError, self.client.get, '/multi-template/')
+
+    def test_memory_saved(self):
+        """
+            Responses should keep fewer objects alive the less they capture.
+        """
+        counts = []
+        for policy in ('full', 'templates', 'none'):
+            with self.capture_responses(policy):
+                counts.append(benchmark.measure_response_memory(self.client, '/multi-template/', 5)['objects_per_response'])
+        self.assert_(counts[0] > counts[1] > counts[2], counts)
+
+class SlimRequestFactoryTests(DjangoTestCase):
+    def test_get_request(self):
+        """
+            Requests from the slim factory should work with views the same
+            way RequestFactory's do.
+        """
+        rf = SlimRequestFactory(HTTP_HOST='example.com')
+        request = rf.get_request('/single-template/', {'q': 'fry'})
+        self.assertEqual('GET', request.method)
+        self.assertEqual('fry', request.GET['q'])
+        self.assertEqual('example.com', request.get_host())
+        self.assert200(views.single_template(request))
+
+        self.assertEqual({}, dict(rf.get_request('/single-template/').GET))
+
+    def test_request_keys_beat_defaults(self):
+        rf = SlimRequestFactory(REQUEST_METHOD='PUT', CONTENT_TYPE='text/plain', SERVER_NAME='example.com')
+        request = rf.get_request('/')
+        self.assertEqual('GET', request.method)
+        self.assertEqual('text/html; charset=utf-8', request.META['CONTENT_TYPE'])
+        self.assertEqual('example.com', request.META['SERVER_NAME'])
+        self.assertEqual('POST', rf.post_request('/', {}).method)
+
+    def test_post_request(self):
+        """
+            Identical multipart payloads should only be encoded once, and
+            still parse on every request.
+        """
+        rf = SlimRequestFactory()
+        data = {'name': 'Leela', 'crew': ['Fry', 'Bender']}
+        first = rf.post_request('/submit/', data)
+        second = rf.post_request('/submit/', dict(data))
+        self.assertEqual(1, len(rf._multipart_cache))
+        for request in (first, second):
+            self.assertEqual('POST', request.method)
+            self.assertEqual('Leela', request.POST['name'])
+            self.assertEqual(['Fry', 'Bender'], request.POST.getlist('crew'))
+
+        request = rf.post_request('/submit/', 'raw body', content_type='text/plain')
+        self.assertEqual('raw body', request.raw_post_data)
+
+class BenchmarkTests(DjangoTestCase):
+    def setUp(self):
+        self.temp_dir = make_temp_dir(self)
+        super(BenchmarkTests, self).setUp()
+
+    def test_view_benchmark(self):
+        """
+            The shipped view benchmarks should run and report their numbers.
+        """
+        for bench in benchmarks.get_benchmarks(iterations=5):
+            bench.warmup = 1
+            result = bench.run()
+            self.assertEqual({'200': 5}, result['status_codes'])
+            self.assertEqual(0, result['queries_per_request'])
+            self.assert_(result['latency_ms']['p50'] <= result['latency_ms']['max'])
+            self.assert_(result['peak_memory_bytes'] > 0)
+
+    def test_benchmark_recipe(self):
+        """
+            Benchmarks should accept views as callables with a request recipe
+            and count the queries they run.
+        """
+        def count_tags(request):
+            models.Tag.objects.count()
+            return HttpResponse(request.POST['name'])
+        bench = benchmark.ViewBenchmark(count_tags, {'method': 'post', 'data': {'name': 'Zoidberg'}},
+            warmup=0, iterations=3)
+        result = bench.run()
+        self.assertEqual('count_tags', result['name'])
+        self.assertEqual(1, result['queries_per_request'])
+
+        path = os.path.join(self.temp_dir, 'results.json')
+        benchmark.write_results([result], path)
+        self.assertEqual(3, benchmark.read_results(path)['count_tags']['iterations'])
+
+    def test_lazy_imports(self):
+        """
+            Importing the test case and the runner shouldn't load what only
+            some tests use.
+        """
+        lazy = {
+            'testhelper.testcase': ('django.contrib.auth.models', 'json', 'gzip'),
+            'testhelper.runners.quiet': ('django.contrib.auth.models', 'django.test.simple', 'cProfile'),
+        }
+        for module in benchmarks.STARTUP_MODULES:
+            result = benchmark.measure_import(module, repeat=1)
+            self.assert_(result['seconds'] > 0)
+            self.assertIn(module, result['modules'])
+            for heavy in lazy[module]:
+                self.assertNotIn(heavy, result['modules'])
+
+    def test_factory_benchmarks(self):
+        """
+            The factory benchmarks should report one result per benchmark and
+            count, with the queries each kind of object costs.
+        """
+        results = []
+        for bench in factorybenchmarks.get_benchmarks(counts=(2,)):
+            bench.repeat = 1
+            results.extend(bench.run(self))
+        self.assertEqual(len(factorybenchmarks.get_benchmarks()), len(results))
+        results = dict([(result['name'], result) for result in results])
+        self.assertEqual(0, results['build_object Article, 2 relations x2']['queries_per_object'])
+        self.assertEqual(3, results['create_object Article, 2 relations x2']['queries_per_object'])
+        self.assert_(results['create_valid_object Tag x2']['objects_per_second'] > 0)
+        for result in results.values():
+            self.assert_(result['memory_per_object_bytes'] > 0, result['name'])
+
+    def test_retained_memory(self):
+        size = benchmark.measure_retained_memory(lambda: ['x' * 1000], 10)
+        self.assert_(10 * 1000 < size < 10 * 2000, size)
+
+    def test_compare_results(self):
+        baseline = {'create': {'name': 'create', 'objects_per_second': 100.0, 'queries_per_object': 2.0}}
+        self.assertEqual([], benchmark.compare_results(
+            [{'name': 'create', 'objects_per_second': 90.0, 'queries_per_object': 2.0}], baseline))
+        self.assertEqual([], benchmark.compare_results([{'name': 'new', 'objects_per_second': 1.0}], baseline))
+        regressions = benchmark.compare_results(
+            [{'name': 'create', 'objects_per_second': 70.0, 'queries_per_object': 3.0}], baseline)
+        self.assertEqual(2, len(regressions))
+        self.assertIn('objects_per_second', regressions[0])
+        self.assertIn('queries_per_object', regressions[1])
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(50, benchmark.percentile(values, 50))
+        self.assertEqual(99, benchmark.percentile(values, 99))
+        self.assertEqual(1, benchmark.percentile([1], 90))
+
+class ConcurrentDriverTests(DjangoTestCase):
+    def test_shared_connection(self):
+        """
+            Threads should see the test's rows through its connection, with
+            their queries counted per request.
+        """
+        tag = self.create_object(models.Tag)
+        tag.save()
+        def tag_count(request):
+            return HttpResponse(str(models.Tag.objects.count()))
+        seen = []
+        def recipe(factory):
+            seen.append(threading.currentThread())
+            return factory.get_request('/')
+        result = concurrency.ConcurrentDriver(tag_count, recipe, concurrency=4, requests=20).run()
+        self.assertEqual({'200': 20}, result['status_codes'])
+        self.assertEqual(1, result['queries_per_request'])
+        self.assertEqual(0, result['error_rate'])
+        self.assert_(len(set(seen)) > 1)
+
+        def check(request):
+            assert models.Tag.objects.get(pk=tag.pk)
+            return HttpResponse()
+        result = concurrency.ConcurrentDriver(check, concurrency=3, requests=6).run()
+        self.assertEqual(0, result['errors'])
+
+    def test_errors(self):
+        def flaky(request):
+            if request.GET.get('fail'):
+                raise ValueError('Boom')
+            return HttpResponse(status=503)
+        result = concurrency.ConcurrentDriver(flaky, {'data': {'fail': 1}}, requests=4).run()
+        self.assertEqual(4, result['errors'])
+        self.assertEqual(1.0, result['error_rate'])
+        self.assertIn('Boom', result['error_samples'][0])
+        result = concurrency.ConcurrentDriver(flaky, requests=4).run()
+        self.assertEqual({'503': 4}, result['status_codes'])
+        self.assertEqual(1.0, result['error_rate'])
+
+        def broken_recipe(factory):
+            raise KeyError('No request')
+        result = concurrency.ConcurrentDriver(flaky, broken_recipe, concurrency=2, requests=4).run()
+        self.assertEqual(4, result['errors'])
+        self.assertIn('No request', result['error_samples'][0])
+
+    def test_through_handler(self):
+        result = concurrency.ConcurrentDriver('single_template', concurrency=2, requests=6,
+            through_handler=True).run()
+        self.assertEqual({'200': 6}, result['status_codes'])
+        self.assertEqual(6, result['requests'])
+
+class FactoryBenchmarkRunTests(unittest2.TestCase):
+    def test_objects_are_rolled_back(self):
+        results = factorybenchmarks.run_benchmark_case(counts=(1,))
+        self.assertEqual(len(factorybenchmarks.get_benchmarks()), len(results))
+        for model in (models.Article, models.Category, models.Archive, models.Tag):
+            self.assertEqual(0, model.objects.count())
+
+class ConcurrentWritesTests(unittest2.TestCase):
+    def test_writes_are_rolled_back(self):
+        "Rows written by the threads should be rolled back with the test."
+        def create_tag(request):
+            models.Tag.objects.create(name='Written by a thread')
+            return HttpResponse()
+        class Writing(DjangoTestCase):
+            def runTest(self):
+                result = concurrency.ConcurrentDriver(create_tag, concurrency=3, requests=6).run()
+                self.assertEqual(0, result['errors'])
+                self.assertEqual(6, models.Tag.objects.count())
+        result = unittest2.TestResult()
+        Writing()(result)
+        self.assertEqual([], result.errors + result.failures)
+        self.assertEqual(0, models.Tag.objects.count())
+
+class JsonStreamTests(unittest2.TestCase):
+    def validate_chunks(self, content, size, **shape):
+        chunks = [content[i:i + size] for i in range(0, len(content), size)]
+        return jsonstream.validate_json(chunks, **shape)
+
+    def test_valid_documents(self):
+        for content in ['{"a": [1, -2.5e3, true, null, "x\\u00e9\\""], "b": {}}', '[]', '3', ' "s" ', '[[[{}]]]']:
+            for size in (1, 2, 3, 1000):
+                self.validate_chunks(content, size)
+
+    def test_error_offsets(self):
+        for content, offset in [('{"a": 1,}', 8), ('[1 2]', 3), ('[1.]', 2), ('[{"a": [tru]}]', 8), ('[1]]', 3), ('[1,', 3), ('[NaN]', 1)]:
+            for size in (1, 2, 3, 1000):
+                try:
+                    self.validate_chunks(content, size)
+                except jsonstream.InvalidJson, e:
+                    self.assertEqual(offset, e.offset, "%r in chunks of %s" % (content, size))
+                else:
+                    self.fail("%r should be invalid" % content)
+
+    def test_shape(self):
+        validator = jsonstream.validate_json('[{"a": [1, 2]}, 2, "3"]', length=3)
+        self.assertEqual('array', validator.root)
+        self.assertEqual(3, validator.length)
+        jsonstream.validate_json('{"a": {"b": 1}, "c": 2}', required_keys=['a', 'c'], min_length=1, max_length=2)
+        with self.assertRaises(jsonstream.InvalidJson):
+            jsonstream.validate_json('{"a": {"b": 1}}', required_keys=['b'])
+        with self.assertRaises(jsonstream.InvalidJson):
+            jsonstream.validate_json('["a"]', required_keys=['a'])
+        with self.assertRaises(jsonstream.InvalidJson):
+            jsonstream.validate_json('[1, 2, 3]', max_length=2)
+
+    def test_invalid_utf8(self):
+        self.validate_chunks('["caf\xc3\xa9"]', 1)
+        for content, offset in [('["caf\xe9"]', 5), ('["\xc3\xa9\xc3"]', 4), ('["a"] \xff', 6)]:
+            for size in (1, 2, 3, 1000):
+                try:
+                    self.validate_chunks(content, size)
+                except jsonstream.InvalidJson, e:
+                    self.assertEqual(offset, e.offset, "%r in chunks of %s" % (content, size))
+                else:
+                    self.fail("%r should be invalid" % content)
+
+    def test_large_chunks_are_split(self):
+        pieces = list(jsonstream.iter_chunks(['a' * 25, u'\xe9' * 3], chunk_size=10))
+        self.assertEqual([10, 10, 5, 6], [len(piece) for piece in pieces])
+
+        # However the content comes in, the C scanner never sees more than a piece of it.
+        scanned = []
+        def scan_once(string, pos):
+            value, end = real_scan_once(string, pos)
+            scanned.append(end - pos)
+            return value, end
+        real_scan_once = jsonstream.scan_once
+        jsonstream.scan_once = scan_once
+        try:
+            item = '{"id": 1, "tags": [1, 2, 3]}'
+            content = '{"results": [%s], "count": 1}' % ', '.join([item] * (3 * jsonstream.CHUNK_SIZE / len(item)))
+            validator = jsonstream.validate_json(HttpResponse(content), required_keys=['results'])
+        finally:
+            jsonstream.scan_once = real_scan_once
+        self.assertEqual(2, validator.length)
+        self.assert_(scanned)
+        self.assert_(max(scanned) <= len(item))